@@ -1,12 +1,20 @@
+import gc
 import os
 import re
 import csv
+import time
 from datetime import datetime
 from pathlib import Path
+from threading import Event, Lock, Thread
+from itertools import repeat
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
 from logging.config import dictConfig
+import numpy as np
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from sqlalchemy import event, text
 from sqlalchemy.orm import DeclarativeBase
 
 
@@ -18,35 +26,280 @@ db = SQLAlchemy(model_class=Base)
 ma = Marshmallow()
 
 
-def add_data_from_csv():
-    """Adds data to the database if it does not already exist."""
+class SeedStatus:
+    """Progress of adding the data from the CSV file to the database when the app starts."""
 
-    from src.models import Item, Data
+    def __init__(self):
+        self.ready = Event()
+        self.progress = 0.0
+        self.error = None
+        self.thread = None
+        self.lock = Lock()
 
-    # If there are no data in the database, then add them
-    first_item = db.session.execute(db.select(Item)).first()
-    if not first_item:
-        print("Start adding data to the database")
-        data_file = Path(__file__).parent.parent.joinpath("data", "dataset_prepared.csv")
-        with open(data_file, 'r') as file:
-            csv_reader = csv.reader(file)
-            header = next(csv_reader)  # Skip header row
-            for col in range(1, len(header), 2):
-                name = header[col].split("_", 1)[-1]
-                brand_number = re.search(r'\d+', name).group()
-                item_number = re.search(r'\d+$', name).group()
-                i = Item(name=name,
-                         brand_number=brand_number,
-                         item_number=item_number)
-                db.session.add(i)
-            for row in csv_reader:
-                for col in range(1, len(row), 2):
-                    d = Data(date=datetime.strptime(row[0], "%Y-%m-%d"),
-                             quantity=row[col],
-                             promotion=int(row[col+1]),
-                             item_id=(col+1)/2)
-                    db.session.add(d)
+
+seed_status = SeedStatus()
+
+
+def _chunk_ranges(data_file, chunk_size):
+    """Splits a CSV file into byte ranges of about chunk_size bytes that start and end on row boundaries.
+
+    :param data_file: Path of the CSV file
+    :param chunk_size: The target number of bytes per range
+    :return: (header, ranges) where ranges is a list of (start, end) byte offsets after the header row
+    """
+    with open(data_file, 'rb') as file:
+        header = file.readline()
+        boundaries = [file.tell()]
+        size = file.seek(0, os.SEEK_END)
+        while boundaries[-1] < size:
+            file.seek(min(boundaries[-1] + chunk_size, size))
+            file.readline()  # Move on to the end of the row
+            boundaries.append(min(file.tell(), size))
+    return header.decode(), list(zip(boundaries, boundaries[1:]))
+
+
+def _parse_chunk(data_file, start, end):
+    """Parses a byte range of the wide format CSV file.
+
+    Runs in a worker process, so it only returns plain data: the dates of the rows and an array of the quantity and
+    promotion columns with one row per date.
+
+    :param data_file: Path of the CSV file
+    :param start: Offset of the first byte of the range
+    :param end: Offset after the last byte of the range
+    :return: (dates, values)
+    """
+    with open(data_file, 'rb') as file:
+        file.seek(start)
+        rows = list(csv.reader(file.read(end - start).decode().splitlines()))
+    dates = [datetime.strptime(row[0], "%Y-%m-%d") for row in rows]
+    values = np.array([row[1:] for row in rows], dtype=np.int64).reshape(len(rows), -1)
+    return dates, values
+
+
+def _last_date(data_file):
+    """Returns the date of the last row of the CSV file."""
+    with open(data_file, 'rb') as file:
+        lines = file.read()[-4096:].splitlines()
+    return datetime.strptime(lines[-1].decode().split(",", 1)[0], "%Y-%m-%d")
+
+
+def add_data_from_csv(progress=None, workers=1, chunk_size=1 << 20, data_file=None):
+    """Adds data to the database if it does not already exist.
+
+    The file is split into byte ranges of about chunk_size bytes which are parsed and reshaped from one column per item
+    to one row per item and date, in a pool of worker processes if workers is more than 1. The rows of each range are
+    inserted and committed in one batch, so other requests can write to the database while it is being seeded.
+
+    As the data are committed in several transactions, a seed_complete row is added to the meta table once they have
+    all been added. If it is missing, any items and data added by a seed that was interrupted are deleted and the data
+    are added again.
+
+    :param progress: Optional function called with the fraction of the file added after each commit
+    :param workers: The number of processes parsing the file
+    :param chunk_size: The target number of bytes of the file parsed and committed at a time
+    :param data_file: Path of the CSV file, by default data/dataset_prepared.csv
+    """
+
+    from src.models import Item, Data, Meta
+
+    data_file = data_file or Path(__file__).parent.parent.joinpath("data", "dataset_prepared.csv")
+    seeded = db.session.get(Meta, "seed_complete") is not None
+    if not seeded and db.session.execute(db.select(Item)).first():
+        # A database seeded before the marker was added has the data of the last date in the file, which an
+        # interrupted seed never has as the file is added in date order
+        if db.session.execute(db.select(Data).filter_by(date=_last_date(data_file))).first():
+            db.session.add(Meta(key="seed_complete", value=datetime.now().isoformat()))
+            db.session.commit()
+            seeded = True
+        else:
+            print("Removing the data added by an interrupted seed")
+            db.session.execute(db.delete(Data))
+            db.session.execute(db.delete(Item))
             db.session.commit()
+    if not seeded:
+        print("Start adding data to the database")
+        header, ranges = _chunk_ranges(data_file, chunk_size)
+        header = next(csv.reader([header]))
+        items = []
+        for col in range(1, len(header), 2):
+            name = header[col].split("_", 1)[-1]
+            brand_number = re.search(r'\d+', name).group()
+            item_number = re.search(r'\d+$', name).group()
+            i = Item(name=name,
+                     brand_number=brand_number,
+                     item_number=item_number)
+            db.session.add(i)
+            items.append(i)
+        # Flush rather than commit, so the items are committed with the first range of data
+        db.session.flush()
+
+        item_ids = [item.item_id for item in items]
+        total = max(ranges[-1][1] - ranges[0][0], 1) if ranges else 1
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) if workers > 1 else None
+        try:
+            chunks = (executor.map(_parse_chunk, repeat(data_file), *zip(*ranges)) if executor and ranges
+                      else (_parse_chunk(data_file, start, end) for start, end in ranges))
+            for (dates, values), (_, end) in zip(chunks, ranges):
+                quantities = values[:, 0::2].tolist()
+                promotions = values[:, 1::2].astype(bool).tolist()
+                db.session.execute(db.insert(Data), [
+                    {"date": date, "quantity": quantity, "promotion": promotion, "item_id": item_id}
+                    for date, row_quantities, row_promotions in zip(dates, quantities, promotions)
+                    for item_id, quantity, promotion in zip(item_ids, row_quantities, row_promotions)
+                ])
+                db.session.commit()
+                if progress:
+                    progress((end - ranges[0][0]) / total)
+        finally:
+            if executor:
+                executor.shutdown()
+        db.session.add(Meta(key="seed_complete", value=datetime.now().isoformat()))
+        db.session.commit()
+    if progress:
+        progress(1.0)
+
+
+def create_comment_search():
+    """Creates the SQLite FTS5 full text index of the comments if it does not already exist.
+
+    The index is an external content table over the comment table, kept in sync by triggers on insert, update and
+    delete, so comments added by post_comment are searchable as soon as they are committed.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comment_fts'")
+    ).first()
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS comment_fts USING fts5("
+        "content, content='comment', content_rowid='comment_id')",
+        "CREATE TRIGGER IF NOT EXISTS comment_fts_insert AFTER INSERT ON comment BEGIN "
+        "INSERT INTO comment_fts(rowid, content) VALUES (new.comment_id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS comment_fts_delete AFTER DELETE ON comment BEGIN "
+        "INSERT INTO comment_fts(comment_fts, rowid, content) VALUES ('delete', old.comment_id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS comment_fts_update AFTER UPDATE ON comment BEGIN "
+        "INSERT INTO comment_fts(comment_fts, rowid, content) VALUES ('delete', old.comment_id, old.content); "
+        "INSERT INTO comment_fts(rowid, content) VALUES (new.comment_id, new.content); END",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    if not exists:
+        # Index the comments that were added before the index existed
+        db.session.execute(text("INSERT INTO comment_fts(comment_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def prepare_data(app):
+    """Builds the compact layout, if configured, and the precomputed analytics from the data in the database.
+
+    :param app: The Flask app
+    """
+    if app.config.get("COMPACT_DATA"):
+        # Copy the data into the compact layout read by the item data routes
+        from src.compact import create_compact_data
+        create_compact_data()
+    # Build the prefix sums used for date range totals
+    from src.analytics import sales_index, similarity_index
+    sales_index.build()
+    # Load or start computing the similar items in the background
+    similarity_index.init_app(app)
+
+
+def seed(app):
+    """Adds the data to the database and builds the precomputed analytics, then marks the app as ready.
+
+    :param app: The Flask app
+    """
+    def report(fraction):
+        seed_status.progress = fraction
+
+    with app.app_context():
+        try:
+            # Add the data to the database if not already added
+            add_data_from_csv(progress=report,
+                              workers=app.config.get("SEED_WORKERS", 1),
+                              chunk_size=app.config.get("SEED_CHUNK_SIZE", 1 << 20))
+            prepare_data(app)
+        except Exception as e:
+            seed_status.error = str(e)
+            app.logger.error(f"An error occurred while seeding the database: {str(e)}")
+            raise
+        finally:
+            db.session.remove()
+    seed_status.ready.set()
+    app.logger.info("The data are ready.")
+
+
+def check_seeded(app):
+    """Marks the app as ready in a worker process forked while the master process was adding the data.
+
+    The thread adding the data in the background does not survive fork(), so instead the worker looks for the
+    seed-complete marker written by the master and prepares its own analytics once the marker is there. Until then
+    the progress reported by the worker is that at the time it was forked.
+
+    :param app: The Flask app
+    """
+    thread = seed_status.thread
+    if seed_status.ready.is_set() or seed_status.error or thread is None or thread.is_alive():
+        return
+    from src.models import Meta
+    with seed_status.lock:
+        if seed_status.ready.is_set() or db.session.get(Meta, "seed_complete") is None:
+            return
+        prepare_data(app)
+        seed_status.progress = 1.0
+        seed_status.ready.set()
+    app.logger.info("The data added by the master process are ready.")
+
+
+# The GET requests made by warm_up() unless WARM_UP_PATHS is configured
+WARM_UP_PATHS = ["/items", "/comments", "/items/top", "/items/forecast", "/analytics/promotion-uplift"]
+
+
+def warm_up(app):
+    """Loads the read-mostly data and caches into memory before a pre-forking server forks its workers.
+
+    Run once in the master process, e.g. by src.wsgi with gunicorn --preload, so that the workers share the modules,
+    schemas, compiled queries, sales index, precomputed analytics and cached responses copy-on-write after fork()
+    instead of each building their own. After fork() each worker applies the changes recorded in the event table to
+    its own copy, so the caches stay current whichever worker a change was made through.
+
+    Waits at most WARM_UP_TIMEOUT seconds, 600 by default, for the data to be added if they are being added in the
+    background, and raises RuntimeError if adding them fails or takes longer.
+
+    :param app: The Flask app
+    """
+    from sqlalchemy.orm import configure_mappers
+    from src.analytics import similarity_index
+
+    deadline = time.monotonic() + app.config.get("WARM_UP_TIMEOUT", 600)
+    while not seed_status.ready.wait(timeout=1):
+        if seed_status.error:
+            raise RuntimeError(f"The data could not be added to the database: {seed_status.error}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("Timed out waiting for the data to be added to the database.")
+    similarity_index.wait(timeout=60)
+    configure_mappers()
+    # Request the common routes so their responses are cached, and the queries and schemas used by them compiled,
+    # without the requests counting towards rate limits or being profiled
+    limits, profiling = app.config.get("RATELIMIT_ENABLED"), app.config.get("PROFILE_ENABLED")
+    app.config.update(RATELIMIT_ENABLED=False, PROFILE_ENABLED=False)
+    try:
+        client = app.test_client()
+        for path in app.config.get("WARM_UP_PATHS", WARM_UP_PATHS):
+            for headers in ({}, {"Accept-Encoding": "gzip"}):
+                client.get(path, headers=headers)
+    finally:
+        app.config.update(RATELIMIT_ENABLED=limits, PROFILE_ENABLED=profiling)
+    # Close the connections so that no SQLite connection is shared between processes
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    # Move the objects created so far out of the garbage collector's generations, so that collections in the workers
+    # do not write to the memory pages holding them and make the workers copy them
+    gc.collect()
+    gc.freeze()
 
 
 def create_app(test_config=None):
@@ -99,13 +352,47 @@ def create_app(test_config=None):
     # Initialise Flask with the SQLAlchemy database extension
     db.init_app(app)
     ma.init_app(app)
+    if app.config.get("SQLITE_MMAP_SIZE"):
+        # Read the database through memory mapping, so that processes share the pages in the OS page cache
+        # rather than each filling its own SQLite page cache
+        with app.app_context():
+            @event.listens_for(db.engine, "connect")
+            def set_mmap_size(dbapi_connection, connection_record):
+                dbapi_connection.execute(f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])}")
+    # Rate limits and concurrency limits of the expensive routes
+    from src.ratelimit import limiter
+    limiter.init_app(app)
 
     from src.models import Account, Comment, Item, Data
     with app.app_context():
         db.create_all()
-        # Add the data to the database if not already added
-        add_data_from_csv()
+        # create_all() only creates the indexes of new tables, so add any missing from existing ones
+        for index in [*Item.__table__.indexes, *Data.__table__.indexes]:
+            index.create(db.engine, checkfirst=True)
+        create_comment_search()
         # Register the routes with the app in the context
         from src import routes
 
+    # Compress large JSON responses and cache those of the item and comment lists and item details until the next
+    # event, which is recorded in the same transaction as every change to the items and comments
+    from src import compression
+    from src.events import broker
+    compression.init_app(app, endpoints=["get_items", "get_data", "get_comments"], version=broker.last_id)
+    # Profile sampled requests when configured
+    from src import profiling
+    profiling.init_app(app)
+
+    # Register the command that reports on the compact layout of the data table
+    from src.compact import compact_report_command
+    app.cli.add_command(compact_report_command)
+
+    # Seed the database, in a background thread if configured so that the health and auth routes can be served
+    # while the data are added
+    seed_status.ready.clear()
+    if app.config.get("SEED_IN_BACKGROUND"):
+        seed_status.thread = Thread(target=seed, args=(app,), name="seed", daemon=True)
+        seed_status.thread.start()
+    else:
+        seed(app)
+
     return app
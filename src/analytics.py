@@ -0,0 +1,581 @@
+from datetime import datetime, timedelta
+import hashlib
+import logging
+from pathlib import Path
+from threading import Event, Lock, Thread
+import numpy as np
+import pandas as pd
+from src import db
+from src.models import Item, Data, Event as ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+
+def _to_day(value):
+    """Returns a date for a date or datetime value."""
+    return value.date() if isinstance(value, datetime) else value
+
+
+class SalesIndex:
+    """Cumulative sums of the daily quantity and promoted quantity of every item.
+
+    The data are laid out as a dense items x days matrix over a daily calendar starting at the first date in the
+    data table. Each row holds the running total of the item, with a leading zero, so the total of any date range is
+    the difference of two entries whatever the length of the range. The version is incremented on every change so
+    that results derived from the index can be cached until the data change, and event_id is the id of the latest
+    event in the event table whose change the index includes.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.start = None
+        self.days = 0
+        self.item_ids = np.empty(0, dtype=np.int64)
+        self.names = []
+        self.positions = {}
+        self.version = 0
+        self.event_id = None
+        self.quantity = np.zeros((0, 0), dtype=np.int64)
+        self.promotion = np.zeros((0, 0), dtype=bool)
+        self.promoted = np.zeros((0, 0), dtype=np.int64)
+        self.cum_quantity = np.zeros((0, 1), dtype=np.int64)
+        self.cum_promoted = np.zeros((0, 1), dtype=np.int64)
+
+    @property
+    def end(self):
+        """The last date of the calendar, or None if the index is empty."""
+        if self.start is None or self.days == 0:
+            return None
+        return self.start + timedelta(days=self.days - 1)
+
+    def build(self):
+        """Builds the index from the item and data tables."""
+        # Read the latest event first, so that changes committed while the data are read are applied again later
+        event_id = db.session.execute(db.select(db.func.max(ChangeEvent.event_id))).scalar() or 0
+        items = db.session.execute(db.select(Item.item_id, Item.name).order_by(Item.item_id)).all()
+        rows = db.session.execute(db.select(Data.item_id, Data.date, Data.quantity, Data.promotion)).all()
+
+        item_ids = np.array([item_id for item_id, _ in items], dtype=np.int64)
+        positions = {int(item_id): row for row, item_id in enumerate(item_ids)}
+        start, days = None, 0
+        quantity = np.zeros((len(item_ids), 0), dtype=np.int64)
+        promotion = np.zeros((len(item_ids), 0), dtype=bool)
+        if rows:
+            dates = np.array([row.date for row in rows], dtype="datetime64[D]")
+            first = dates.min()
+            offsets = (dates - first).astype(np.int64)
+            start, days = first.item(), int(offsets.max()) + 1
+            quantity = np.zeros((len(item_ids), days), dtype=np.int64)
+            promotion = np.zeros((len(item_ids), days), dtype=bool)
+            owners = np.array([positions.get(row.item_id, -1) for row in rows], dtype=np.int64)
+            amounts = np.array([row.quantity for row in rows], dtype=np.int64)
+            flags = np.array([row.promotion for row in rows], dtype=bool)
+            known = owners >= 0
+            np.add.at(quantity, (owners[known], offsets[known]), amounts[known])
+            promotion[owners[known], offsets[known]] = flags[known]
+        promoted = quantity * promotion
+
+        with self._lock:
+            self.start, self.days = start, days
+            self.item_ids = item_ids
+            self.names = [name for _, name in items]
+            self.positions = positions
+            self.quantity, self.promotion, self.promoted = quantity, promotion, promoted
+            self.cum_quantity = self._cumulate(quantity)
+            self.cum_promoted = self._cumulate(promoted)
+            self.event_id = event_id
+            self.version += 1
+
+    def refresh_item(self, item_id):
+        """Recomputes the row of a single item after it has been added, changed or deleted.
+
+        A new item is appended as a row and the row of a deleted item is removed, so only the data of the item are
+        read. Falls back to a full rebuild if the item has data outside the calendar.
+
+        :param item_id: The id of the item that changed
+        """
+        item = db.session.execute(db.select(Item).filter_by(item_id=item_id)).scalar_one_or_none()
+        if item is None:
+            self._remove_row(item_id)
+            return
+        rows = db.session.execute(
+            db.select(Data.date, Data.quantity, Data.promotion).filter_by(item_id=item_id)
+        ).all()
+        offsets = [(_to_day(d) - self.start).days for d, _, _ in rows] if self.start else [-1] * len(rows)
+        if any(o < 0 or o >= self.days for o in offsets):
+            self.build()
+            return
+
+        quantity = np.zeros(self.days, dtype=np.int64)
+        promotion = np.zeros(self.days, dtype=bool)
+        for offset, (_, amount, flag) in zip(offsets, rows):
+            quantity[offset] += amount
+            promotion[offset] = flag
+        promoted = quantity * promotion
+        with self._lock:
+            row = self.positions.get(item_id)
+            if row is None:
+                # Append a row of zeros for the new item. The arrays are replaced rather than resized in place, as
+                # copies of them may be in use without the lock
+                row = len(self.item_ids)
+                self.item_ids = np.append(self.item_ids, item_id)
+                self.names = [*self.names, item.name]
+                self.positions = {**self.positions, item_id: row}
+                self.quantity, self.promotion, self.promoted, self.cum_quantity, self.cum_promoted = (
+                    np.vstack((values, np.zeros((1, values.shape[1]), dtype=values.dtype)))
+                    for values in (self.quantity, self.promotion, self.promoted, self.cum_quantity,
+                                   self.cum_promoted))
+            self.names[row] = item.name
+            self.quantity[row], self.promotion[row], self.promoted[row] = quantity, promotion, promoted
+            self.cum_quantity[row, 1:] = np.cumsum(quantity)
+            self.cum_promoted[row, 1:] = np.cumsum(promoted)
+            self.version += 1
+
+    def _remove_row(self, item_id):
+        """Removes the row of a deleted item, if it is indexed."""
+        with self._lock:
+            row = self.positions.get(item_id)
+            if row is None:
+                return
+            self.item_ids = np.delete(self.item_ids, row)
+            self.names = self.names[:row] + self.names[row + 1:]
+            self.positions = {int(other): position for position, other in enumerate(self.item_ids)}
+            self.quantity, self.promotion, self.promoted, self.cum_quantity, self.cum_promoted = (
+                np.delete(values, row, axis=0)
+                for values in (self.quantity, self.promotion, self.promoted, self.cum_quantity, self.cum_promoted))
+            self.version += 1
+
+    def range_sum(self, item_id, start=None, end=None):
+        """Returns the total quantity and promoted quantity of an item between two dates inclusive.
+
+        :param item_id: The id of the item
+        :param start: The first date of the range, defaults to the start of the data
+        :param end: The last date of the range, defaults to the end of the data
+        :returns: A (quantity, promoted_quantity) tuple, or None if the item is not indexed
+        """
+        with self._lock:
+            row = self.positions.get(item_id)
+            if row is None:
+                return None
+            first, last = self._bounds(start, end)
+            return (int(self.cum_quantity[row, last] - self.cum_quantity[row, first]),
+                    int(self.cum_promoted[row, last] - self.cum_promoted[row, first]))
+
+    def top(self, start=None, end=None, n=10):
+        """Returns the n best selling items between two dates inclusive.
+
+        :param start: The first date of the range, defaults to the start of the data
+        :param end: The last date of the range, defaults to the end of the data
+        :param n: The number of items to return
+        :returns: A list of dicts ordered by quantity, highest first
+        """
+        with self._lock:
+            first, last = self._bounds(start, end)
+            quantity = self.cum_quantity[:, last] - self.cum_quantity[:, first]
+            promoted = self.cum_promoted[:, last] - self.cum_promoted[:, first]
+            n = min(n, len(quantity))
+            if n == 0:
+                return []
+            best = np.argpartition(-quantity, n - 1)[:n]
+            best = best[np.lexsort((self.item_ids[best], -quantity[best]))]
+            return [{"item_id": int(self.item_ids[row]),
+                     "name": self.names[row],
+                     "quantity": int(quantity[row]),
+                     "promoted_quantity": int(promoted[row])} for row in best]
+
+    def _bounds(self, start, end):
+        """Converts an inclusive date range into column indices of the cumulative sums."""
+        if self.start is None:
+            return 0, 0
+        first = 0 if start is None else (_to_day(start) - self.start).days
+        last = self.days if end is None else (_to_day(end) - self.start).days + 1
+        first, last = min(max(first, 0), self.days), min(max(last, 0), self.days)
+        return first, max(first, last)
+
+    @staticmethod
+    def _cumulate(values):
+        """Returns the running totals of each row with a leading zero column."""
+        cumulative = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.int64)
+        np.cumsum(values, axis=1, out=cumulative[:, 1:])
+        return cumulative
+
+
+class VersionedCache:
+    """Memoizes results until the version of the data they were computed from changes."""
+
+    def __init__(self, maxsize=32):
+        self._lock = Lock()
+        self.maxsize = maxsize
+        self.version = None
+        self.results = {}
+
+    def get(self, version, key, compute):
+        """Returns the cached result for the key, calling compute() if there is none for this version.
+
+        :param version: The version of the data the result depends on
+        :param key: The key of the result within the version, e.g. the query arguments
+        :param compute: A function without arguments that computes the result
+        """
+        with self._lock:
+            if self.version == version and key in self.results:
+                return self.results[key]
+        result = compute()
+        with self._lock:
+            if self.version != version:
+                self.version, self.results = version, {}
+            if len(self.results) >= self.maxsize:
+                self.results.pop(next(iter(self.results)))
+            self.results[key] = result
+        return result
+
+
+sales_index = SalesIndex()
+results_cache = VersionedCache()
+
+# The number of recent weeks that the weekday baseline of the forecast is averaged over
+FORECAST_WEEKS = 8
+
+
+def _forecast_all(horizon):
+    """Forecasts the daily quantity of every item for the given number of days after the end of the data.
+
+    The baseline of each item is the mean quantity of each weekday over the last FORECAST_WEEKS weeks, counting only
+    days without a promotion. The promotion uplift is the ratio of the mean quantity on promoted days to the mean
+    quantity on other days over the whole history. All items are computed together as matrix operations.
+
+    :param horizon: The number of days to forecast
+    :returns: A dict of the forecast of each item keyed by item id
+    """
+    with sales_index._lock:
+        start, days = sales_index.start, sales_index.days
+        item_ids, names = sales_index.item_ids, list(sales_index.names)
+        quantity = sales_index.quantity.astype(float)
+        promotion = sales_index.promotion.copy()
+    if start is None:
+        return {int(item_id): {"item_id": int(item_id), "name": name, "uplift": 1.0, "forecast": []}
+                for item_id, name in zip(item_ids, names)}
+
+    # Weekday baseline from the recent non-promoted days, one column per weekday
+    window = min(days, FORECAST_WEEKS * 7)
+    weekdays = (start.weekday() + np.arange(days - window, days)) % 7
+    one_hot = np.eye(7)[weekdays]
+    recent, recent_promotion = quantity[:, -window:], promotion[:, -window:]
+    sums = np.where(recent_promotion, 0.0, recent) @ one_hot
+    counts = (~recent_promotion).astype(float) @ one_hot
+    fallback = recent.mean(axis=1, keepdims=True)
+    baseline = np.divide(sums, counts, out=np.repeat(fallback, 7, axis=1), where=counts > 0)
+
+    # Promotion uplift over the whole history
+    promoted_days = promotion.sum(axis=1)
+    plain_days = days - promoted_days
+    promoted_mean = np.divide((quantity * promotion).sum(axis=1), promoted_days,
+                              out=np.zeros(len(item_ids)), where=promoted_days > 0)
+    plain_mean = np.divide((quantity * ~promotion).sum(axis=1), plain_days,
+                           out=np.zeros(len(item_ids)), where=plain_days > 0)
+    uplift = np.divide(promoted_mean, plain_mean, out=np.ones(len(item_ids)),
+                       where=(promoted_mean > 0) & (plain_mean > 0))
+
+    future = baseline[:, (start.weekday() + days + np.arange(horizon)) % 7].round(2)
+    future_promoted = (future * uplift[:, None]).round(2)
+    dates = [(start + timedelta(days=days + offset)).isoformat() for offset in range(horizon)]
+    return {int(item_id): {"item_id": int(item_id),
+                           "name": name,
+                           "uplift": round(float(uplift[row]), 3),
+                           "forecast": [{"date": day, "quantity": q, "promoted_quantity": p}
+                                        for day, q, p in zip(dates, future[row].tolist(),
+                                                             future_promoted[row].tolist())]}
+            for row, (item_id, name) in enumerate(zip(item_ids, names))}
+
+
+def forecast(horizon):
+    """Returns the forecasts of all items, computed once per version of the data and horizon.
+
+    :param horizon: The number of days to forecast
+    :returns: A dict of the forecast of each item keyed by item id
+    """
+    return results_cache.get(sales_index.version, ("forecast", horizon), lambda: _forecast_all(horizon))
+
+
+def lttb(x, y, points):
+    """Returns the indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept. The points in between are split into points - 2 buckets, and from each
+    bucket the point forming the largest triangle with the point kept from the previous bucket and the mean of the
+    next bucket is kept. This preserves the peaks and troughs that a chart of the full series would show.
+
+    :param x: Array of the x values in increasing order
+    :param y: Array of the y values
+    :param points: The number of points to keep
+    :returns: Array of indices in increasing order
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    count = len(y)
+    if points >= count:
+        return np.arange(count)
+    if points < 3:
+        return np.array([0, count - 1][:max(points, 0)], dtype=np.int64)
+    edges = (np.arange(points - 1) * (count - 2) / (points - 2)).astype(np.int64) + 1
+    edges[-1] = count - 1
+    # Mean of each bucket, with the last point standing in for the bucket after the last
+    sums_x, sums_y = np.add.reduceat(x[:-1], edges[:-1]), np.add.reduceat(y[:-1], edges[:-1])
+    sizes = np.diff(edges)
+    mean_x = np.append(sums_x / sizes, x[-1])
+    mean_y = np.append(sums_y / sizes, y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        first, last = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[previous] - mean_x[bucket + 1]) * (y[first:last] - y[previous])
+                       - (x[previous] - x[first:last]) * (mean_y[bucket + 1] - y[previous]))
+        previous = first + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_buckets(y, points):
+    """Returns the indices of the minimum and maximum of each of points / 2 equal buckets of the series.
+
+    :param y: Array of the y values
+    :param points: The maximum number of points to keep
+    :returns: Array of indices in increasing order
+    """
+    y = np.asarray(y, dtype=float)
+    count = len(y)
+    buckets = max(points // 2, 1)
+    if points >= count:
+        return np.arange(count)
+    bucket = np.arange(count) * buckets // count
+    # Sorting by bucket then value puts the minimum first and the maximum last in each bucket
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets))
+    ends = np.append(starts[1:], count) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+
+DOWNSAMPLERS = {
+    "lttb": lttb,
+    "minmax": lambda x, y, points: minmax_buckets(y, points),
+}
+
+
+class SimilarityIndex:
+    """The items whose daily quantities are most correlated with each item.
+
+    The Pearson correlation of every pair of items is computed by a background thread from the matrices of the sales
+    index, a block of rows at a time so that memory stays proportional to the number of items rather than its square.
+    Only the top MAX_NEIGHBOURS of each item are kept, and they are saved to disk with a fingerprint of the data so that
+    a restart does not recompute them unless the data have changed.
+    """
+
+    MAX_NEIGHBOURS = 20
+    BLOCK_SIZE = 256
+
+    def __init__(self):
+        self._pending = Event()
+        self._ready = Event()
+        self._thread = None
+        self._thread_lock = Lock()
+        self.path = None
+        self.neighbours = {}
+
+    def init_app(self, app):
+        """Loads the saved neighbours if they match the data, otherwise starts computing them.
+
+        The location of the saved file is the SIMILARITY_PATH config value, by default in the instance folder.
+        """
+        self.path = Path(app.config.get("SIMILARITY_PATH") or Path(app.instance_path).joinpath("similarity.npz"))
+        if not self._load():
+            self.schedule()
+
+    def schedule(self):
+        """Requests that the neighbours are recomputed in the background."""
+        self._pending.set()
+        with self._thread_lock:
+            # Start the thread on first use, and again in a worker forked from a process where it was running, as
+            # threads do not survive fork()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="similarity-index", daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """Blocks until the neighbours have been computed, returns False if the timeout expired first."""
+        return self._ready.wait(timeout)
+
+    def similar(self, item_id, k):
+        """Returns the ids and correlations of the k items most similar to the item, or None if unknown.
+
+        :param item_id: The id of the item
+        :param k: The number of similar items, at most MAX_NEIGHBOURS
+        """
+        entry = self.neighbours.get(item_id)
+        if entry is None:
+            return None
+        item_ids, scores = entry
+        return list(zip(item_ids[:k].tolist(), scores[:k].tolist()))
+
+    def _run(self):
+        """Recomputes the neighbours each time they are scheduled."""
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            with sales_index._lock:
+                item_ids, quantity = sales_index.item_ids.copy(), sales_index.quantity.copy()
+            try:
+                positions, correlations = self.compute(quantity)
+            except (ValueError, MemoryError) as e:
+                logger.error(f"An error occurred computing the item similarity: {str(e)}")
+                continue
+            self._store(item_ids, positions, correlations)
+            self._save(self._fingerprint(item_ids, quantity), item_ids, positions, correlations)
+            self._ready.set()
+
+    @classmethod
+    def compute(cls, quantity):
+        """Returns the row positions and correlations of the most similar rows of each row of a matrix.
+
+        :param quantity: items x days matrix of daily quantities
+        :returns: (positions, correlations) arrays of shape items x min(MAX_NEIGHBOURS, items - 1), most similar first
+        """
+        count = quantity.shape[0]
+        k = min(cls.MAX_NEIGHBOURS, count - 1)
+        if k < 1:
+            return np.empty((count, 0), dtype=np.int64), np.empty((count, 0))
+        # Centre and scale each row so that the dot product of two rows is their correlation
+        centred = quantity - quantity.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(centred, axis=1, keepdims=True)
+        scaled = np.divide(centred, norms, out=np.zeros_like(centred, dtype=float), where=norms > 0)
+
+        positions = np.empty((count, k), dtype=np.int64)
+        correlations = np.empty((count, k))
+        for first in range(0, count, cls.BLOCK_SIZE):
+            last = min(first + cls.BLOCK_SIZE, count)
+            block = scaled[first:last] @ scaled.T
+            block[np.arange(last - first), np.arange(first, last)] = -np.inf
+            best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(block, best, axis=1)
+            order = np.argsort(-scores, axis=1, kind="stable")
+            positions[first:last] = np.take_along_axis(best, order, axis=1)
+            correlations[first:last] = np.take_along_axis(scores, order, axis=1)
+        return positions, correlations
+
+    def _store(self, item_ids, positions, correlations):
+        """Replaces the neighbours with the result of compute()."""
+        self.neighbours = {int(item_id): (item_ids[positions[row]], correlations[row].round(4))
+                           for row, item_id in enumerate(item_ids)}
+
+    @staticmethod
+    def _fingerprint(item_ids, quantity):
+        """Returns a hash of the data the neighbours are computed from."""
+        return hashlib.sha1(item_ids.tobytes() + quantity.tobytes()).hexdigest()
+
+    def _save(self, fingerprint, item_ids, positions, correlations):
+        """Saves the result of compute() to disk, replacing the previous file in one step."""
+        partial = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(partial, "wb") as file:
+                np.savez(file, fingerprint=fingerprint, item_ids=item_ids, positions=positions,
+                         correlations=correlations)
+            partial.replace(self.path)
+        except OSError:
+            partial.unlink(missing_ok=True)
+
+    def _load(self):
+        """Loads the saved neighbours, returns False if there are none or the data have changed since."""
+        try:
+            with np.load(self.path) as saved:
+                with sales_index._lock:
+                    fingerprint = self._fingerprint(sales_index.item_ids, sales_index.quantity)
+                if str(saved["fingerprint"]) != fingerprint:
+                    return False
+                self._store(saved["item_ids"], saved["positions"], saved["correlations"])
+        except (OSError, KeyError, ValueError):
+            return False
+        self._ready.set()
+        return True
+
+
+similarity_index = SimilarityIndex()
+
+
+# Held while the changes are applied, so concurrent requests do not apply the same changes twice
+_changes_lock = Lock()
+
+
+def apply_changes():
+    """Brings the precomputed analytics up to date with the changes recorded in the event table.
+
+    Every change to an item is recorded as an event in the same transaction, so each worker process applies the
+    changes made through all of them, refreshing the row of each item changed since the index was last updated.
+    The index is rebuilt if some of the events since then are no longer kept.
+    """
+    with _changes_lock:
+        seen = sales_index.event_id
+        oldest, newest = db.session.execute(db.select(db.func.min(ChangeEvent.event_id),
+                                                      db.func.max(ChangeEvent.event_id))).one()
+        newest = newest or 0
+        if seen == newest:
+            return
+        if seen is None or (oldest or 1) > seen + 1 or seen > newest:
+            sales_index.build()
+        else:
+            item_ids = db.session.execute(
+                db.select(ChangeEvent.item_id).distinct()
+                .where(ChangeEvent.event_id > seen, ChangeEvent.event_id <= newest, ChangeEvent.item_id.is_not(None))
+            ).scalars().all()
+            for item_id in item_ids:
+                sales_index.refresh_item(item_id)
+            sales_index.event_id = newest
+            if not item_ids:
+                return
+    similarity_index.schedule()
+
+
+def _uplift_by(frame, key):
+    """Returns the promotion uplift statistics of the data grouped by the given column.
+
+    :param frame: DataFrame with the key, quantity and promotion columns
+    :param key: The column to group by, e.g. item_id or brand_number
+    :returns: A list of dicts, one per group
+    """
+    stats = (frame.groupby([key, "promotion"])["quantity"]
+             .agg(["mean", "median", "var", "count"])
+             .unstack("promotion")
+             .reindex(columns=pd.MultiIndex.from_product([["mean", "median", "var", "count"], [False, True]])))
+    promoted, plain = stats.xs(True, axis=1, level=1), stats.xs(False, axis=1, level=1)
+    promoted_days, plain_days = promoted["count"].fillna(0), plain["count"].fillna(0)
+    uplift = promoted["mean"] - plain["mean"]
+    # 95% confidence interval of the difference in means using the normal approximation
+    error = 1.96 * np.sqrt(promoted["var"] / promoted_days + plain["var"] / plain_days)
+    result = pd.DataFrame({
+        key: stats.index.astype(int),
+        "promoted_days": promoted_days.astype(int),
+        "promoted_share": promoted_days / (promoted_days + plain_days),
+        "mean_promoted": promoted["mean"],
+        "mean_not_promoted": plain["mean"],
+        "mean_uplift": uplift,
+        "mean_uplift_ratio": promoted["mean"] / plain["mean"].where(plain["mean"] > 0),
+        "median_uplift": promoted["median"] - plain["median"],
+        "ci_low": uplift - error,
+        "ci_high": uplift + error,
+    }).round(4)
+    return result.astype(object).where(result.notna(), None).to_dict(orient="records")
+
+
+def _promotion_uplift():
+    """Computes the promotion uplift of every item and brand from the data table."""
+    rows = db.session.execute(
+        db.select(Data.item_id, Item.brand_number, Data.quantity, Data.promotion).join(Item)
+    ).all()
+    frame = pd.DataFrame(rows, columns=["item_id", "brand_number", "quantity", "promotion"])
+    frame["promotion"] = frame["promotion"].astype(bool)
+    return {"items": _uplift_by(frame, "item_id"), "brands": _uplift_by(frame, "brand_number")}
+
+
+def promotion_uplift():
+    """Returns the promotion uplift of every item and brand, computed once per version of the data.
+
+    :returns: A dict with the list of item statistics and the list of brand statistics
+    """
+    return results_cache.get(sales_index.version, ("promotion-uplift",), _promotion_uplift)
@@ -0,0 +1,232 @@
+import os
+import re
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from pathlib import Path
+import click
+from flask import current_app as app
+from flask.cli import with_appcontext
+from sqlalchemy import MetaData, Table, Column, Integer, Boolean, create_engine, select, text
+from src import db
+
+# Day numbers count the days since this date, so a date fits in an integer of one to three bytes
+EPOCH = date(1970, 1, 1)
+
+compact_metadata = MetaData()
+
+# The data table clustered on (item_id, day_number). WITHOUT ROWID stores the rows in the primary key b-tree itself,
+# so there is no separate rowid table, surrogate data_id or index, and the rows of an item are stored together.
+compact_data = Table(
+    "data",
+    compact_metadata,
+    Column("item_id", Integer, primary_key=True),
+    Column("day_number", Integer, primary_key=True),
+    Column("quantity", Integer, nullable=False),
+    Column("promotion", Boolean, nullable=False),
+    sqlite_with_rowid=False,
+)
+
+# The compact layout kept alongside the data table in the app's database, read by the item data routes when
+# COMPACT_DATA is set. It has its own metadata so that create_all() does not create it.
+live_compact_data = compact_data.to_metadata(MetaData(), name="data_compact")
+
+# SQL expression of the day number of the date column of a data row
+DAY_NUMBER_SQL = "CAST(julianday(substr({row}.date, 1, 10)) - julianday('1970-01-01') AS INTEGER)"
+
+
+def to_day_number(value):
+    """Returns the number of days between the epoch and a date or datetime."""
+    return (value.date() if hasattr(value, "date") else value).toordinal() - EPOCH.toordinal()
+
+
+def from_day_number(day_number):
+    """Returns the date and time in the same ISO format as the API for a day number."""
+    return (EPOCH + timedelta(days=day_number)).isoformat() + "T00:00:00"
+
+
+def read_compact_series(connection, item_id, start=None, end=None, table=compact_data):
+    """Returns the data of an item from the compact layout with ISO format dates, as returned by the API.
+
+    :param connection: Connection to a database with the compact layout
+    :param item_id: The id of the item
+    :param start: Optional first date of the range
+    :param end: Optional last date of the range
+    :param table: The compact table, live_compact_data in the app's database
+    :returns: A list of dicts with date, quantity and promotion
+    """
+    return read_compact_batch(connection, [item_id], start, end, table).get(item_id, [])
+
+
+def read_compact_batch(connection, item_ids, start=None, end=None, table=compact_data):
+    """Returns the data of several items from the compact layout in one query, see read_compact_series().
+
+    :returns: A dict of the list of data of each item found keyed by item id
+    """
+    query = select(table.c.item_id, table.c.day_number, table.c.quantity, table.c.promotion).where(
+        table.c.item_id.in_(item_ids)).order_by(table.c.item_id, table.c.day_number)
+    if start:
+        query = query.where(table.c.day_number >= to_day_number(start))
+    if end:
+        query = query.where(table.c.day_number <= to_day_number(end))
+    series = {}
+    for item_id, day_number, quantity, promotion in connection.execute(query):
+        series.setdefault(item_id, []).append(
+            {"date": from_day_number(day_number), "quantity": quantity, "promotion": promotion})
+    return series
+
+
+def create_compact_data():
+    """Creates the compact copy of the data table in the app's database if it does not already exist.
+
+    The copy is kept in sync with the data table by triggers on insert, update and delete, in the same way as the
+    comment search index, so that the item data routes can read from it when COMPACT_DATA is set.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_compact'")
+    ).first()
+    live_compact_data.create(db.session.connection(), checkfirst=True)
+    new_day, old_day = DAY_NUMBER_SQL.format(row="new"), DAY_NUMBER_SQL.format(row="old")
+    insert = ("INSERT OR REPLACE INTO data_compact (item_id, day_number, quantity, promotion) "
+              f"VALUES (new.item_id, {new_day}, new.quantity, new.promotion);")
+    delete = f"DELETE FROM data_compact WHERE item_id = old.item_id AND day_number = {old_day};"
+    statements = [
+        f"CREATE TRIGGER IF NOT EXISTS data_compact_insert AFTER INSERT ON data BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS data_compact_delete AFTER DELETE ON data BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS data_compact_update AFTER UPDATE ON data BEGIN {delete} {insert} END",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    if not exists:
+        # Copy the data that were added before the compact table existed
+        db.session.execute(text(
+            "INSERT OR REPLACE INTO data_compact (item_id, day_number, quantity, promotion) "
+            f"SELECT item_id, {DAY_NUMBER_SQL.format(row='data')}, quantity, promotion FROM data "
+            "ORDER BY item_id, date"))
+    db.session.commit()
+
+
+def read_series(connection, item_id, start=None, end=None):
+    """Returns the data of an item from the current layout with ISO format dates, as returned by the API."""
+    from src.models import Data
+
+    query = select(Data.date, Data.quantity, Data.promotion).where(Data.item_id == item_id).order_by(Data.date)
+    if start:
+        query = query.where(Data.date >= start)
+    if end:
+        query = query.where(Data.date < end + timedelta(days=1))
+    return [{"date": day.isoformat(), "quantity": quantity, "promotion": promotion}
+            for day, quantity, promotion in connection.execute(query)]
+
+
+def copy_data(target_path, compact):
+    """Copies the data table into a new SQLite file in either the current or the compact layout.
+
+    :param target_path: Path of the new database file, replaced if it exists
+    :param compact: True for the compact layout, False for a copy of the current layout
+    """
+    Path(target_path).unlink(missing_ok=True)
+    engine = create_engine("sqlite:///" + str(target_path))
+    if compact:
+        compact_metadata.create_all(engine)
+    engine.dispose()
+
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("ATTACH DATABASE ? AS target", (str(target_path),))
+        if compact:
+            connection.exec_driver_sql(
+                "INSERT INTO target.data (item_id, day_number, quantity, promotion) "
+                f"SELECT item_id, {DAY_NUMBER_SQL.format(row='data')}, quantity, promotion FROM main.data "
+                "ORDER BY item_id, date")
+        else:
+            # Create the table with exactly the same definition as the current one
+            definition = connection.exec_driver_sql(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'data'").scalar_one()
+            connection.exec_driver_sql(definition.replace("CREATE TABLE data", "CREATE TABLE target.data", 1))
+            connection.exec_driver_sql("INSERT INTO target.data SELECT * FROM main.data ORDER BY data_id")
+            # and the same indexes, so that the reads are compared with those of the live table
+            indexes = connection.exec_driver_sql(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = 'data' AND sql IS NOT NULL"
+            ).scalars().all()
+            for index in indexes:
+                connection.exec_driver_sql(re.sub(r"^(CREATE (UNIQUE )?INDEX )", r"\1target.", index))
+        connection.commit()
+        connection.exec_driver_sql("DETACH DATABASE target")
+    engine = create_engine("sqlite:///" + str(target_path))
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    engine.dispose()
+
+
+def time_reads(path, reader, item_ids, start, end, repeats):
+    """Returns the median seconds to read the full series and a date range of each item on a new connection."""
+    engine = create_engine("sqlite:///" + str(path))
+    full, ranged = [], []
+    for _ in range(repeats):
+        for item_id in item_ids:
+            with engine.connect() as connection:
+                began = time.perf_counter()
+                reader(connection, item_id)
+                full.append(time.perf_counter() - began)
+                began = time.perf_counter()
+                reader(connection, item_id, start, end)
+                ranged.append(time.perf_counter() - began)
+    engine.dispose()
+    return statistics.median(full), statistics.median(ranged)
+
+
+@click.command("compact-report")
+@click.option("--output", type=click.Path(dir_okay=False), default=None,
+              help="Path of the compact database, by default database_compact.sqlite in the instance folder.")
+@click.option("--samples", default=20, help="The number of items to time reads for.")
+@click.option("--repeats", default=3, help="The number of times each read is timed.")
+@with_appcontext
+def compact_report_command(output, samples, repeats):
+    """Copies the data table into the compact layout and compares it with the current layout.
+
+    The compact copy is kept at the output path. A copy of the current layout is made alongside it so both files are
+    compared freshly vacuumed, and is deleted afterwards.
+    """
+    output = Path(output or Path(app.instance_path).joinpath("database_compact.sqlite"))
+    current = output.with_name(output.stem + "_current.sqlite")
+    copy_data(output, compact=True)
+    copy_data(current, compact=False)
+
+    with db.engine.connect() as connection:
+        all_item_ids = connection.execute(text("SELECT DISTINCT item_id FROM data ORDER BY item_id")).scalars().all()
+        first, last = connection.execute(text("SELECT MIN(date), MAX(date) FROM data")).one()
+    item_ids = random.Random(0).sample(all_item_ids, min(samples, len(all_item_ids)))
+    if not item_ids:
+        current.unlink()
+        raise click.ClickException("The data table is empty.")
+    # A 90 day range from the middle of the data
+    first, last = date.fromisoformat(first[:10]), date.fromisoformat(last[:10])
+    start = first + (last - first) / 2
+    end = start + timedelta(days=89)
+
+    # Check that the compact layout returns the same data with the same ISO dates
+    current_engine = create_engine("sqlite:///" + str(current))
+    compact_engine = create_engine("sqlite:///" + str(output))
+    with current_engine.connect() as a, compact_engine.connect() as b:
+        for item_id in item_ids:
+            if read_series(a, item_id) != read_compact_series(b, item_id):
+                raise click.ClickException(f"The compact data of item {item_id} differ from the current data.")
+    current_engine.dispose()
+    compact_engine.dispose()
+
+    current_full, current_range = time_reads(current, read_series, item_ids, start, end, repeats)
+    compact_full, compact_range = time_reads(output, read_compact_series, item_ids, start, end, repeats)
+    current_size, compact_size = os.path.getsize(current), os.path.getsize(output)
+    current.unlink()
+
+    click.echo(f"{'':24}{'current':>12}{'compact':>12}{'change':>10}")
+    for label, before, after, unit, scale in (
+            ("File size", current_size, compact_size, "KiB", 1 / 1024),
+            ("Full series read", current_full, compact_full, "ms", 1000),
+            ("90 day range read", current_range, compact_range, "ms", 1000)):
+        click.echo(f"{label:24}{before * scale:>9.2f}{unit:>3}{after * scale:>9.2f}{unit:>3}"
+                   f"{(after - before) / before:>+10.0%}")
+    click.echo(f"Compact database written to {output}")
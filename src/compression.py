@@ -0,0 +1,143 @@
+import gzip
+from collections import OrderedDict
+from threading import Lock
+from flask import request, g, Response
+
+# Brotli and Zstandard are optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, compresslevel=6)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=5)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+
+# The encodings offered in order of preference when the client accepts several equally
+PREFERENCE = [encoding for encoding in ("zstd", "br", "gzip") if encoding in COMPRESSORS]
+
+
+class ResponseCache:
+    """The serialized JSON of GET responses and their compressed encodings, keyed by the request path and query.
+
+    The entries are those of a single version of the data. Versions are increasing integers, and the entries are
+    dropped as soon as a newer version is seen.
+    """
+
+    def __init__(self, maxsize=256):
+        self._lock = Lock()
+        self.maxsize = maxsize
+        self.version = None
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        """Returns the cached entry for the key if it is of the given version of the data, or None."""
+        with self._lock:
+            if version != self.version:
+                return None
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, mimetype, body):
+        """Caches the uncompressed body of a response, evicting the least recently used entry if full.
+
+        The body is not cached if it is of an older version than the entries, as the data changed while it was made.
+        """
+        entry = {"mimetype": mimetype, "identity": body, "encoded": {}}
+        with self._lock:
+            if self.version is not None and version < self.version:
+                return entry
+            if version != self.version:
+                self.version, self.entries = version, OrderedDict()
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """Removes all the entries."""
+        with self._lock:
+            self.version = None
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def negotiate():
+    """Returns the best encoding accepted by the client, or None for no compression."""
+    return request.accept_encodings.best_match(PREFERENCE)
+
+
+def encode(entry, encoding):
+    """Returns the body of a cache entry compressed with the encoding, compressing it only the first time."""
+    body = entry["encoded"].get(encoding)
+    if body is None:
+        body = entry["encoded"][encoding] = COMPRESSORS[encoding](entry["identity"])
+    return body
+
+
+def init_app(app, endpoints, version):
+    """Compresses JSON responses and caches those of the given GET endpoints.
+
+    JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed with the best encoding in the Accept-Encoding
+    header of the request. For the given endpoints the serialized body and each compressed encoding are cached, so a
+    repeated request is answered before the view runs. Each request reads the current version of the data, which
+    must be shared by all the worker processes, and a cached body is only served for the version it was made from.
+
+    :param app: The Flask app
+    :param endpoints: The names of the view functions whose responses are cached
+    :param version: Function returning the current version of the data, increased by every change
+    """
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    response_cache.maxsize = app.config.get("COMPRESS_CACHE_SIZE", response_cache.maxsize)
+    endpoints = set(endpoints)
+
+    def cacheable():
+        return request.method == "GET" and request.endpoint in endpoints
+
+    @app.before_request
+    def serve_cached_response():
+        """Return the cached response if there is one, without running the view."""
+        if not cacheable():
+            return None
+        # Read the version before the view runs, so a change made while it runs is not cached as the new version
+        g.cache_version = version()
+        entry = response_cache.get(request.full_path, g.cache_version)
+        if entry is None:
+            return None
+        g.cached_response = True
+        encoding = negotiate() if len(entry["identity"]) >= app.config["COMPRESS_MIN_SIZE"] else None
+        response = Response(encode(entry, encoding) if encoding else entry["identity"], mimetype=entry["mimetype"])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    @app.after_request
+    def compress_response(response):
+        """Compress JSON responses above the size threshold, and cache those of the cached endpoints."""
+        if request.method != "GET":
+            return response
+        if (g.get("cached_response") or response.status_code != 200 or response.is_streamed
+                or not response.is_json or "Content-Encoding" in response.headers):
+            return response
+        body = response.get_data()
+        entry = {"identity": body, "encoded": {}}
+        if cacheable():
+            entry = response_cache.put(request.full_path, g.cache_version, response.mimetype, body)
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate() if len(body) >= app.config["COMPRESS_MIN_SIZE"] else None
+        if encoding:
+            response.set_data(encode(entry, encoding))
+            response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,92 @@
+import json
+import time
+from src import db
+from src.models import Event
+
+
+class EventBroker:
+    """Publishes changes to the data to the clients of the server-sent events stream.
+
+    Events are rows of the event table, added in the same transaction as the change they describe, so every worker
+    process streams the same events with the same ids and a client can resume from any of them. The ids come from an
+    AUTOINCREMENT key so they keep increasing across restarts. The most recent history events are kept so that a client
+    that reconnects with the id of the last event it received is sent the events it missed.
+
+    Each stream polls the table while it is open and holds a worker thread for as long as the client is connected, so
+    the app should be served by threaded workers, e.g. gunicorn --worker-class gthread, rather than sync workers.
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+
+    def publish(self, event_type, data, item_id=None):
+        """Adds an event to the session, to be committed with the change it describes.
+
+        :param event_type: The name of the event, e.g. comment.created
+        :param data: The JSON serializable data of the event
+        :param item_id: The id of the item the event is about, if any
+        :returns: The id of the event
+        """
+        event = Event(type=event_type, item_id=item_id, data=json.dumps(data))
+        db.session.add(event)
+        db.session.flush()
+        db.session.execute(db.delete(Event).where(Event.event_id <= event.event_id - self.history))
+        return event.event_id
+
+    @staticmethod
+    def last_id():
+        """Returns the id of the latest event, or 0 if there are none."""
+        with db.engine.connect() as connection:
+            return connection.execute(db.select(db.func.max(Event.event_id))).scalar() or 0
+
+    @staticmethod
+    def since(last_id, limit=100):
+        """Returns up to limit events after the given id, and whether any events after it are no longer kept.
+
+        The events are read on a connection of their own, so that a stream does not keep a transaction open.
+        """
+        with db.engine.connect() as connection:
+            oldest, newest = connection.execute(db.select(db.func.min(Event.event_id),
+                                                          db.func.max(Event.event_id))).one()
+            events = connection.execute(
+                db.select(Event.event_id, Event.type, Event.data)
+                .where(Event.event_id > last_id).order_by(Event.event_id).limit(limit)
+            ).all()
+        missed = (oldest or 1) > last_id + 1 or last_id > (newest or 0)
+        return [tuple(event) for event in events], missed
+
+    def stream(self, last_id=None, heartbeat=15, poll=1.0):
+        """Yields the events after last_id in text/event-stream format, then each new event as it is published.
+
+        If events after last_id are no longer kept a reset event is sent instead of them, so the client knows to
+        fetch the data again. A comment is sent after heartbeat seconds without events to keep the connection open.
+        Must be run in an app context, e.g. with stream_with_context().
+
+        :param last_id: The id of the last event the client received, or None for only new events
+        :param heartbeat: The seconds between keep-alive comments
+        :param poll: The seconds between reads of the event table
+        """
+        yield "retry: 3000\n\n"
+        if last_id is None:
+            last_id = self.last_id()
+        idle = 0.0
+        while True:
+            events, missed = self.since(last_id)
+            if missed:
+                last_id = self.last_id()
+                yield f"event: reset\ndata: {json.dumps({'last_event_id': last_id})}\n\n"
+                continue
+            for event_id, event_type, data in events:
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+                last_id = event_id
+            if events:
+                idle = 0.0
+                continue
+            time.sleep(poll)
+            idle += poll
+            if idle >= heartbeat:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+
+broker = EventBroker()
@@ -1,7 +1,7 @@
 from functools import wraps
 from datetime import datetime, timedelta
 import jwt
-from flask import request, make_response, current_app as app
+from flask import request, make_response, abort, current_app as app
 from src import db
 from src.models import Account
 
@@ -77,4 +77,39 @@ def token_required(f):
             return make_response(response, 401)
         return f(*args, **kwargs)
 
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def parse_date_arg(name):
+    """Returns the date given in the query argument of the request with the given name.
+
+    If the argument is not a date in YYYY-MM-DD format, abort with a 400 error.
+
+    :param: string name  The name of the query argument
+    :return: date, or None if the argument is missing
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        abort(400, description=f"'{name}' must be a date in YYYY-MM-DD format.")
+
+
+def parse_int_arg(name, default=None):
+    """Returns the integer given in the query argument of the request with the given name.
+
+    If the argument is not an integer, abort with a 400 error.
+
+    :param: string name  The name of the query argument
+    :param: default  The value returned if the argument is missing
+    :return: int, or the default if the argument is missing
+    """
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, description=f"'{name}' must be an integer.")
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -37,8 +37,9 @@ class Comment(db.Model):
 
 class Item(db.Model):
     __tablename__ = "item"
+    __table_args__ = (db.Index("ix_item_brand_number_item_number", "brand_number", "item_number"),)
     item_id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(db.Text, nullable=False)
+    name: Mapped[str] = mapped_column(db.Text, nullable=False, index=True)
     brand_number: Mapped[int] = mapped_column(db.Integer, nullable=False)
     item_number: Mapped[int] = mapped_column(db.Integer, nullable=False)
     data: Mapped[List["Data"]] = relationship(back_populates="item")
@@ -46,9 +47,26 @@ class Item(db.Model):
 
 class Data(db.Model):
     __tablename__ = "data"
+    __table_args__ = (db.Index("ix_data_item_id_date", "item_id", "date"),)
     data_id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(db.DateTime, nullable=False)
     quantity: Mapped[int] = mapped_column(db.Integer, nullable=False)
     promotion: Mapped[bool] = mapped_column(db.Boolean, nullable=False)
     item_id: Mapped[int] = mapped_column(ForeignKey("item.item_id"))
     item: Mapped["Item"] = relationship("Item", back_populates="data")
+
+
+class Meta(db.Model):
+    __tablename__ = "meta"
+    key: Mapped[str] = mapped_column(db.String, primary_key=True)
+    value: Mapped[str] = mapped_column(db.String, nullable=False)
+
+
+class Event(db.Model):
+    __tablename__ = "event"
+    # AUTOINCREMENT so that the ids of deleted events are never reused
+    __table_args__ = {"sqlite_autoincrement": True}
+    event_id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    type: Mapped[str] = mapped_column(db.String, nullable=False)
+    item_id: Mapped[Optional[int]] = mapped_column(db.Integer)
+    data: Mapped[str] = mapped_column(db.Text, nullable=False)
@@ -0,0 +1,81 @@
+import cProfile
+import hmac
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from flask import request, g
+
+
+def init_app(app):
+    """Profiles sampled requests, or those with the trusted profiling header, with cProfile and tracemalloc.
+
+    Profiling is off unless PROFILE_ENABLED is set, in which case a request is profiled if it is randomly sampled at
+    PROFILE_SAMPLE_RATE, or if its PROFILE_HEADER header (X-Profile by default) equals PROFILE_TOKEN. The profile of
+    each request is saved as a pstats file in a folder per route in PROFILE_DIR, by default instance/profiles, which
+    can be loaded with pstats or turned into a flame graph by tools such as flameprof or snakeviz. A line with the
+    duration and, if PROFILE_TRACEMALLOC is set, the peak memory allocated is added to summary.jsonl in the folder.
+
+    :param app: The Flask app
+    """
+    app.config.setdefault("PROFILE_ENABLED", False)
+    app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+    app.config.setdefault("PROFILE_HEADER", "X-Profile")
+    app.config.setdefault("PROFILE_TOKEN", None)
+    app.config.setdefault("PROFILE_TRACEMALLOC", False)
+    app.config.setdefault("PROFILE_DIR", str(Path(app.instance_path).joinpath("profiles")))
+
+    def requested():
+        token, header = app.config["PROFILE_TOKEN"], request.headers.get(app.config["PROFILE_HEADER"])
+        # Compare bytes, as compare_digest() raises TypeError on str with non-ASCII characters
+        if token and header and hmac.compare_digest(header.encode(), token.encode()):
+            return True
+        return random.random() < app.config["PROFILE_SAMPLE_RATE"]
+
+    @app.before_request
+    def start_profile():
+        """Start profiling the request if it is sampled or requested."""
+        if not app.config["PROFILE_ENABLED"] or not requested():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return
+        g.profile = profile
+        # Trace allocations only while the request is profiled, as tracing slows down every allocation
+        if app.config["PROFILE_TRACEMALLOC"] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            g.profile_tracemalloc = True
+        g.profile_started = time.perf_counter()
+
+    @app.after_request
+    def save_profile(response):
+        """Stop profiling the request and save the profile and summary."""
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        duration = time.perf_counter() - g.pop("profile_started")
+        peak = None
+        if g.pop("profile_tracemalloc", False):
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        folder = Path(app.config["PROFILE_DIR"]).joinpath(request.endpoint or "unknown")
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder.joinpath(f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.method}.pstats")
+        profile.dump_stats(path)
+        summary = {"file": path.name,
+                   "method": request.method,
+                   "path": request.full_path,
+                   "status": response.status_code,
+                   "duration_ms": round(duration * 1000, 3),
+                   "peak_allocated_bytes": peak}
+        with open(folder.joinpath("summary.jsonl"), "a") as file:
+            file.write(json.dumps(summary) + "\n")
+        app.logger.info(f"Profiled {request.method} {request.full_path} in {summary['duration_ms']} ms: {path}")
+        return response
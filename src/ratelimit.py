@@ -0,0 +1,149 @@
+import sqlite3
+import time
+from contextlib import closing
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+from flask import request, make_response, current_app as app
+from src.helpers import decode_auth_token
+
+
+class MemoryBackend:
+    """Token buckets held in the memory of the process, so each worker process has its own limits."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.buckets = {}
+
+    def take(self, key, cost, rate, burst):
+        """Takes cost tokens from the bucket of the key if it holds enough.
+
+        The bucket holds at most burst tokens and is refilled at rate tokens per second.
+
+        :returns: (allowed, seconds until enough tokens are available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            self.buckets[key] = (tokens - cost if allowed else tokens, now)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def clear(self):
+        """Empties all the buckets."""
+        with self._lock:
+            self.buckets.clear()
+
+
+class SQLiteBackend:
+    """Token buckets held in a local SQLite file, so that the worker processes of a host share the same limits.
+
+    Each update runs in an immediate transaction, so concurrent workers take tokens one at a time.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def take(self, key, cost, rate, burst):
+        """Takes cost tokens from the bucket of the key if it holds enough, see MemoryBackend.take()."""
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            allowed = tokens >= cost
+            connection.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                               (key, tokens - cost if allowed else tokens, now))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def clear(self):
+        """Empties all the buckets."""
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM bucket")
+
+
+class RateLimiter:
+    """Per-client token bucket rate limits and per-route concurrency limits for expensive routes.
+
+    Limits are only enforced when RATELIMIT_ENABLED is set. Clients are identified by the user id in their token
+    if they send a valid one, otherwise by their IP address. Each client has a bucket of RATELIMIT_BURST tokens
+    refilled at RATELIMIT_RATE tokens per second, and each request to a limited route takes the cost of the route.
+    The buckets are kept in memory, or in the SQLite file at RATELIMIT_STORAGE to share them between processes.
+    """
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self._semaphores = {}
+
+    def init_app(self, app):
+        """Sets the default config values and the backend from the config of the app."""
+        app.config.setdefault("RATELIMIT_ENABLED", False)
+        app.config.setdefault("RATELIMIT_RATE", 5.0)
+        app.config.setdefault("RATELIMIT_BURST", 20.0)
+        app.config.setdefault("RATELIMIT_MAX_CONCURRENT", 4)
+        storage = app.config.get("RATELIMIT_STORAGE")
+        self.backend = SQLiteBackend(storage) if storage else MemoryBackend()
+
+    @staticmethod
+    def client_key():
+        """Returns the user id of the client if the request has a valid token, otherwise the client's IP address."""
+        token = request.headers.get("Authorization")
+        if token:
+            payload = decode_auth_token(token)
+            if isinstance(payload, dict) and "sub" in payload:
+                return f"user:{payload['sub']}"
+        return f"ip:{request.remote_addr}"
+
+    def limit(self, cost=1):
+        """Decorator that rate limits a route, returning 429 Too Many Requests if the client has too few tokens.
+
+        :param cost: The number of tokens a request to the route takes
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not app.config["RATELIMIT_ENABLED"]:
+                    return f(*args, **kwargs)
+                allowed, retry_after = self.backend.take(f"{self.client_key()}:{request.endpoint}", cost,
+                                                         app.config["RATELIMIT_RATE"], app.config["RATELIMIT_BURST"])
+                if not allowed:
+                    response = make_response({"message": "Too many requests. Please try again later."}, 429)
+                    response.headers["Retry-After"] = str(max(int(retry_after + 0.999), 1))
+                    return response
+                return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def bounded(self, f):
+        """Decorator that limits the number of requests to a route running at once in this process.
+
+        Requests over RATELIMIT_MAX_CONCURRENT are not queued but answered at once with 503 Service Unavailable.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not app.config["RATELIMIT_ENABLED"]:
+                return f(*args, **kwargs)
+            semaphore = self._semaphores.setdefault(
+                request.endpoint, BoundedSemaphore(app.config["RATELIMIT_MAX_CONCURRENT"]))
+            if not semaphore.acquire(blocking=False):
+                response = make_response({"message": "The server is busy. Please try again later."}, 503)
+                response.headers["Retry-After"] = "1"
+                return response
+            try:
+                return f(*args, **kwargs)
+            finally:
+                semaphore.release()
+        return wrapper
+
+
+limiter = RateLimiter()
@@ -1,12 +1,19 @@
-from datetime import datetime
-from flask import json, current_app as app, request, make_response, abort, jsonify
+from datetime import datetime, timedelta
+import numpy as np
+from flask import json, current_app as app, request, make_response, abort, jsonify, Response, stream_with_context
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
 from marshmallow.exceptions import ValidationError
 from werkzeug.exceptions import HTTPException
-from src import db
+from src import db, seed_status, check_seeded
 from src.models import Item, Data, Account, Comment
 from src.schemas import ItemSchema, DetailSchema, CommentSchema
-from src.helpers import token_required, encode_auth_token
+from src.helpers import token_required, encode_auth_token, parse_date_arg, parse_int_arg
+from src.ratelimit import limiter
+from src.events import broker
+from src.compact import live_compact_data, read_compact_series, read_compact_batch
+from src.analytics import sales_index, similarity_index, apply_changes, forecast, promotion_uplift, DOWNSAMPLERS
 
 # Flask-Marshmallow Schemas
 comments_schema = CommentSchema(many=True)
@@ -14,6 +21,7 @@ comment_schema = CommentSchema()
 items_schema = ItemSchema(many=True)
 item_schema = ItemSchema()
 detail_schema = DetailSchema()
+details_schema = DetailSchema(many=True)
 
 
 @app.errorhandler(Exception)
@@ -79,8 +87,66 @@ def register_validation_error(error):
     return response, 400
 
 
+@app.before_request
+def require_data():
+    """Return 503 Service Unavailable for the item and analytics routes until the database has been seeded."""
+    check_seeded(app)
+    if not seed_status.ready.is_set() and request.path.startswith(("/items", "/analytics")):
+        response = make_response({"message": "The data are still being loaded. Please try again later.",
+                                  "progress": round(seed_status.progress, 3)}, 503)
+        response.headers["Retry-After"] = "5"
+        return response
+
+
+@app.before_request
+def apply_data_changes():
+    """Apply the changes made through other worker processes to the precomputed analytics before reading them."""
+    if request.method == "GET" and request.path.startswith(("/items", "/analytics")):
+        apply_changes()
+
+
+# HEALTH ROUTES
+@app.get("/health/live")
+def health_live():
+    """Returns 200 as soon as the app is serving requests."""
+    return {"status": "live"}
+
+
+@app.get("/health/ready")
+def health_ready():
+    """Returns 200 once the data have been loaded, otherwise 503 with the progress of loading them."""
+    status = {"ready": seed_status.ready.is_set(),
+              "progress": round(seed_status.progress, 3),
+              "error": seed_status.error}
+    return make_response(status, 200 if status["ready"] else 503)
+
+
+# EVENT ROUTES
+@app.get("/events")
+def get_events():
+    """Streams new comments and changes to items as server-sent events.
+
+    The events are comment.created, item.created, item.updated and item.deleted, each with a JSON data line and an
+    increasing id. A client that reconnects with the Last-Event-ID header, or the last_event_id query argument, is
+    first sent the events it missed, or a reset event if they are no longer available. The events are read from the
+    database, so a client sees the changes made through every worker process.
+
+    :returns: text/event-stream
+    """
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        abort(400, description="The last event id must be an integer.")
+    stream = broker.stream(last_id, heartbeat=app.config.get("EVENTS_HEARTBEAT", 15),
+                           poll=app.config.get("EVENTS_POLL_INTERVAL", 1.0))
+    return Response(stream_with_context(stream), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # AUTHENTICATION ROUTES
 @app.post("/register")
+@limiter.limit(cost=5)
 def register():
     """Register a new user for the REST API
 
@@ -131,6 +197,7 @@ def register():
 
 
 @app.post('/login')
+@limiter.limit(cost=5)
 def login():
     """Logins in the User and generates a token
 
@@ -186,6 +253,43 @@ def get_comments():
         return make_response(msg, 500)
 
 
+@app.get("/comments/search")
+@limiter.limit(cost=1)
+def search_comments():
+    """Returns the comments matching a full text search in JSON, best matches first.
+
+    The query argument q holds the words to search for; comments must contain all of them. The optional page and
+    per_page arguments select a page of the results.
+
+    :returns: JSON
+    """
+    words = request.args.get("q", "").split()
+    if not words:
+        abort(400, description="'q' must contain at least one word to search for.")
+    page = max(parse_int_arg("page", 1), 1)
+    per_page = min(max(parse_int_arg("per_page", 20), 1), 100)
+    # Quote each word so that FTS5 query syntax in the search is matched literally
+    match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+    try:
+        total = db.session.execute(
+            text("SELECT COUNT(*) FROM comment_fts WHERE comment_fts MATCH :match"), {"match": match}
+        ).scalar_one()
+        comment_ids = db.session.execute(
+            text("SELECT rowid FROM comment_fts WHERE comment_fts MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": per_page, "offset": (page - 1) * per_page}
+        ).scalars().all()
+        comments = db.session.execute(db.select(Comment).where(Comment.comment_id.in_(comment_ids))).scalars()
+        by_id = {comment.comment_id: comment for comment in comments}
+        return {"page": page,
+                "per_page": per_page,
+                "total": total,
+                "comments": comments_schema.dump([by_id[comment_id] for comment_id in comment_ids])}
+    except SQLAlchemyError as e:
+        app.logger.error(f"An error occurred while searching comments: {str(e)}")
+        msg = {'message': "An Internal Server Error occurred."}
+        return make_response(msg, 500)
+
+
 @app.post('/comments')
 @token_required
 def post_comment():
@@ -201,6 +305,9 @@ def post_comment():
 
         try:
             db.session.add(comment)
+            db.session.flush()
+            # Record the event in the same transaction as the comment
+            broker.publish("comment.created", comment_schema.dump(comment))
             db.session.commit()
             return {"message": f"Comment added with id= {comment.comment_id}"}
         except SQLAlchemyError as e:
@@ -215,15 +322,57 @@ def post_comment():
 
 
 # ITEM ROUTES
+ITEM_SORT_COLUMNS = {"item_id": Item.item_id, "name": Item.name,
+                     "brand_number": Item.brand_number, "item_number": Item.item_number}
+
+
+def prefix_upper_bound(prefix):
+    """Returns the smallest string greater than every string starting with the prefix, or None if there is none.
+
+    Trailing U+10FFFF characters cannot be incremented so they are dropped, and the surrogate code points, which
+    cannot be stored as UTF-8, are skipped.
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    return prefix[:-1] + chr(0xE000 if 0xD800 <= following <= 0xDFFF else following)
+
+
 @app.get("/items")
 def get_items():
     """Returns a list of items and their details in JSON.
 
+    The optional query arguments filter and order the items in the database query:
+    brand, the brand number; name, a case-sensitive prefix of the name; sort, one of item_id, name, brand_number or
+    item_number, prefixed with - for descending order; and limit and offset to select a page of items.
+
     :returns: JSON
     """
+    query = db.select(Item)
+    brand = parse_int_arg("brand")
+    if brand is not None:
+        query = query.where(Item.brand_number == brand)
+    prefix = request.args.get("name")
+    if prefix:
+        # A range rather than LIKE so that the index on name is used
+        query = query.where(Item.name >= prefix)
+        upper = prefix_upper_bound(prefix)
+        if upper is not None:
+            query = query.where(Item.name < upper)
+    sort = request.args.get("sort", "item_id")
+    column = ITEM_SORT_COLUMNS.get(sort.lstrip("-"))
+    if column is None:
+        abort(400, description=f"'sort' must be one of {', '.join(ITEM_SORT_COLUMNS)}, optionally prefixed with -.")
+    query = query.order_by(column.desc() if sort.startswith("-") else column, Item.item_id)
+    limit = parse_int_arg("limit")
+    offset = parse_int_arg("offset", 0)
+    if (limit is not None and limit < 1) or offset < 0:
+        abort(400, description="'limit' must be a positive integer and 'offset' must not be negative.")
+    query = query.limit(limit).offset(offset)
     try:
-        # Select all the items using Flask-SQLAlchemy
-        all_items = db.session.execute(db.select(Item)).scalars()
+        # Select the items using Flask-SQLAlchemy
+        all_items = db.session.execute(query).scalars()
         try:
             return items_schema.dump(all_items)
         except ValidationError as e:
@@ -236,10 +385,153 @@ def get_items():
         return make_response(msg, 500)
 
 
+@app.get("/items/batch")
+@limiter.limit(cost=5)
+@limiter.bounded
+def get_items_batch():
+    """Returns the data of several items in JSON.
+
+    The query argument ids is a comma separated list of up to 100 item ids, and the optional start and end arguments
+    are dates in YYYY-MM-DD format limiting the data returned. The items and their data are loaded with two queries
+    whatever the number of items, the data from the compact layout of the data table if COMPACT_DATA is set.
+
+    :returns: JSON with the details of the items found and the ids of those not found
+    """
+    try:
+        item_ids = list(dict.fromkeys(int(item_id) for item_id in request.args.get("ids", "").split(",") if item_id))
+    except ValueError:
+        abort(400, description="'ids' must be a comma separated list of item ids.")
+    if not 1 <= len(item_ids) <= 100:
+        abort(400, description="'ids' must contain between 1 and 100 item ids.")
+    start, end = parse_date_arg("start"), parse_date_arg("end")
+    data = Item.data
+    if start:
+        data = data.and_(Data.date >= start)
+    if end:
+        data = data.and_(Data.date < end + timedelta(days=1))
+    try:
+        if app.config.get("COMPACT_DATA"):
+            # Read the data of all the items from the compact layout in one query
+            items = db.session.execute(db.select(Item).where(Item.item_id.in_(item_ids))).scalars().all()
+            series = read_compact_batch(db.session.connection(), item_ids, start, end, table=live_compact_data)
+            details = {item.item_id: {**item_schema.dump(item), "data": series.get(item.item_id, [])}
+                       for item in items}
+        else:
+            items = db.session.execute(
+                db.select(Item).where(Item.item_id.in_(item_ids)).options(selectinload(data))
+            ).scalars().all()
+            details = {item.item_id: detail_schema.dump(item) for item in items}
+    except SQLAlchemyError as e:
+        app.logger.error(f"A SQLAlchemy database error occurred: {str(e)}")
+        msg = {'message': "An Internal Server Error occurred."}
+        return make_response(msg, 500)
+    return {"items": [details[item_id] for item_id in item_ids if item_id in details],
+            "missing": [item_id for item_id in item_ids if item_id not in details]}
+
+
+@app.get("/items/top")
+def get_top_items():
+    """Returns the best selling items between two dates in JSON.
+
+    The optional query arguments are start and end, dates in YYYY-MM-DD format, and n, the number of items to
+    return. The totals are read from the prefix sums in the sales index rather than by scanning the data table.
+
+    :returns: JSON
+    """
+    start = parse_date_arg("start")
+    end = parse_date_arg("end")
+    n = parse_int_arg("n", 10)
+    if n < 1:
+        abort(400, description="'n' must be a positive integer.")
+    return jsonify(sales_index.top(start, end, n))
+
+
+@app.get("/items/<int:item_id>/total")
+def get_item_total(item_id):
+    """Returns the total quantity and promoted quantity of an item between two dates in JSON.
+
+    :param item_id: The id of the item
+    :param type item_id: int
+    :returns: JSON
+    """
+    start = parse_date_arg("start") or sales_index.start
+    end = parse_date_arg("end") or sales_index.end
+    totals = sales_index.range_sum(item_id, start, end)
+    if totals is None:
+        abort(404, description="Item not found.")
+    quantity, promoted_quantity = totals
+    return {"item_id": item_id,
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "quantity": quantity,
+            "promoted_quantity": promoted_quantity}
+
+
+def get_horizon_arg():
+    """Returns the number of days to forecast from the horizon query argument, 28 by default."""
+    horizon = parse_int_arg("horizon", 28)
+    if not 1 <= horizon <= 365:
+        abort(400, description="'horizon' must be an integer between 1 and 365.")
+    return horizon
+
+
+@app.get("/items/forecast")
+def get_forecasts():
+    """Returns the demand forecast of every item in JSON.
+
+    The forecasts of all items are computed together and cached until the data change.
+
+    :returns: JSON
+    """
+    return jsonify(list(forecast(get_horizon_arg()).values()))
+
+
+@app.get("/items/<int:item_id>/forecast")
+def get_item_forecast(item_id):
+    """Returns the demand forecast of the item with the given id in JSON.
+
+    :param item_id: The id of the item
+    :param type item_id: int
+    :returns: JSON
+    """
+    item_forecast = forecast(get_horizon_arg()).get(item_id)
+    if item_forecast is None:
+        abort(404, description="Item not found.")
+    return item_forecast
+
+
+@app.get("/items/<int:item_id>/similar")
+def get_similar_items(item_id):
+    """Returns the items whose daily quantities are most correlated with the item with the given id in JSON.
+
+    The optional query argument k is the number of items to return. The similar items are precomputed in the
+    background, so 503 is returned until the first computation has finished.
+
+    :param item_id: The id of the item
+    :param type item_id: int
+    :returns: JSON
+    """
+    k = parse_int_arg("k", 5)
+    if not 1 <= k <= similarity_index.MAX_NEIGHBOURS:
+        abort(400, description=f"'k' must be an integer between 1 and {similarity_index.MAX_NEIGHBOURS}.")
+    if not similarity_index.wait(timeout=0):
+        abort(503, description="The similar items are still being computed. Please try again later.")
+    similar = similarity_index.similar(item_id, k)
+    if similar is None:
+        abort(404, description="Item not found.")
+    names = dict(zip(sales_index.item_ids.tolist(), sales_index.names))
+    return jsonify([{"item_id": similar_id, "name": names[similar_id], "correlation": correlation}
+                    for similar_id, correlation in similar if similar_id in names])
+
+
 @app.get("/items/<int:item_id>")
+@limiter.limit(cost=1)
+@limiter.bounded
 def get_data(item_id):
     """ Returns data of the item with the given id in JSON.
 
+    The data are read from the compact layout of the data table if COMPACT_DATA is set.
+
     :param item_id: The id of the item to return
     :param type item_id: int
     :returns: JSON
@@ -248,12 +540,58 @@ def get_data(item_id):
         data = db.session.execute(
             db.select(Item).filter_by(item_id=item_id)
         ).scalar_one()
+        if app.config.get("COMPACT_DATA"):
+            return {**item_schema.dump(data),
+                    "data": read_compact_series(db.session.connection(), item_id, table=live_compact_data)}
         return detail_schema.dump(data)
     except SQLAlchemyError as e:
         app.logger.error(f"A SQLAlchemy database error occurred: {str(e)}")
         abort(404, description="Item not found.")
 
 
+@app.get("/items/<int:item_id>/series")
+def get_series(item_id):
+    """Returns the daily data of the item with the given id downsampled for charting in JSON.
+
+    The optional query arguments are points, the maximum number of points to return, method, either lttb
+    (Largest-Triangle-Three-Buckets, the default) or minmax (the minimum and maximum of each bucket), and start and end,
+    dates in YYYY-MM-DD format. Without points the full series is returned. The data are read from the compact layout
+    of the data table if COMPACT_DATA is set.
+
+    :param item_id: The id of the item
+    :param type item_id: int
+    :returns: JSON
+    """
+    points = parse_int_arg("points")
+    method = request.args.get("method", "lttb")
+    if points is not None and points < 3:
+        abort(400, description="'points' must be an integer of at least 3.")
+    if method not in DOWNSAMPLERS:
+        abort(400, description=f"'method' must be one of {', '.join(DOWNSAMPLERS)}.")
+    start, end = parse_date_arg("start"), parse_date_arg("end")
+    query = db.select(Data.date, Data.quantity, Data.promotion).filter_by(item_id=item_id).order_by(Data.date)
+    if start:
+        query = query.where(Data.date >= start)
+    if end:
+        query = query.where(Data.date < end + timedelta(days=1))
+    try:
+        if db.session.get(Item, item_id) is None:
+            abort(404, description="Item not found.")
+        if app.config.get("COMPACT_DATA"):
+            rows = read_compact_series(db.session.connection(), item_id, start, end, table=live_compact_data)
+        else:
+            rows = [{"date": row.date.isoformat(), "quantity": row.quantity, "promotion": row.promotion}
+                    for row in db.session.execute(query)]
+    except SQLAlchemyError as e:
+        app.logger.error(f"A SQLAlchemy database error occurred: {str(e)}")
+        msg = {'message': "An Internal Server Error occurred."}
+        return make_response(msg, 500)
+    if points is not None and rows:
+        days = np.array([row["date"][:10] for row in rows], dtype="datetime64[D]").astype(np.int64)
+        rows = [rows[i] for i in DOWNSAMPLERS[method](days, [row["quantity"] for row in rows], points)]
+    return jsonify(rows)
+
+
 @app.post('/items')
 @token_required
 def add_item():
@@ -269,7 +607,10 @@ def add_item():
 
         try:
             db.session.add(item)
+            db.session.flush()
+            broker.publish("item.created", item_schema.dump(item), item_id=item.item_id)
             db.session.commit()
+            apply_changes()
             return {"message": f"Item added with id= {item.item_id}"}
         except SQLAlchemyError as e:
             app.logger.error(f"An error occurred saving the item: {str(e)}")
@@ -300,7 +641,9 @@ def delete_item(item_id):
         for datum in data:
             db.session.delete(datum)
         db.session.delete(item)
+        broker.publish("item.deleted", {"item_id": item_id}, item_id=item_id)
         db.session.commit()
+        apply_changes()
         return {"message": f"The item with id {item_id} has been deleted"}
     except SQLAlchemyError as e:
         app.logger.error(f"The item with id {item_id} does not exist. Error: {str(e)}")
@@ -335,9 +678,31 @@ def data_update(item_id):
     # Commit the changes to the database
     try:
         db.session.add(data_updated)
+        broker.publish("item.updated", item_schema.dump(data_updated), item_id=item_id)
         db.session.commit()
+        apply_changes()
         return {"message": f"Item with id {item_id} updated."}
     except SQLAlchemyError as e:
         app.logger.error(f"A SQLAlchemy database error occurred: {str(e)}")
         msg = "An Internal Server Error occurred."
         return make_response(msg, 500)
+
+
+# ANALYTICS ROUTES
+@app.get("/analytics/promotion-uplift")
+@limiter.limit(cost=2)
+@limiter.bounded
+def get_promotion_uplift():
+    """Returns the effect of promotions on the daily quantity of each item and brand in JSON.
+
+    For each item and brand this includes the mean and median uplift, the 95% confidence interval of the mean uplift
+    and the share of days with a promotion. The result is cached until the data change.
+
+    :returns: JSON
+    """
+    try:
+        return promotion_uplift()
+    except SQLAlchemyError as e:
+        app.logger.error(f"An error occurred while computing the promotion uplift: {str(e)}")
+        msg = {'message': "An Internal Server Error occurred."}
+        return make_response(msg, 500)
@@ -0,0 +1,26 @@
+import os
+from src import create_app, warm_up, db
+
+# Entry point for pre-forking servers. Load it once in the master process, e.g.
+#
+#     gunicorn --preload --workers 4 --worker-class gthread --threads 8 src.wsgi:app
+#
+# so that the data and caches loaded by warm_up() are shared copy-on-write by the workers. Each worker keeps its copy
+# up to date with the changes made through the others by reading the event table, which every change is recorded in.
+# Threaded workers are used so that an open /events stream holds a thread rather than a whole worker.
+#
+# With SEED_IN_BACKGROUND set the warm-up is skipped, so the workers are forked at once and serve /health/live while
+# the master adds the data. Each worker then prepares its own analytics once the master has finished, see
+# check_seeded(), so nothing is shared copy-on-write on that start.
+app = create_app()
+if not app.config.get("SEED_IN_BACKGROUND"):
+    warm_up(app)
+
+
+def _dispose_connections():
+    """Drops the database connections inherited from the master, which may still be using them to add the data."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_connections)
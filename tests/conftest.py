@@ -2,7 +2,8 @@ import os
 import string
 import secrets
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+import jwt
 import pytest
 from faker import Faker
 from sqlalchemy import exists
@@ -26,9 +27,11 @@ def app():
 
     # Location for the temporary testing database
     db_path = Path(__file__).parent.parent.joinpath('data', 'testdb.sqlite')
+    similarity_path = Path(__file__).parent.parent.joinpath('data', 'test_similarity.npz')
     test_cfg = {
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(db_path),
+        "SIMILARITY_PATH": str(similarity_path),
     }
     app = create_app(test_config=test_cfg)
 
@@ -45,8 +48,9 @@ def app():
 
         # Explicitly close the database connection
         db.engine.dispose()
-    # Delete the test database
+    # Delete the test database and the saved similar items
     os.unlink(db_path)
+    similarity_path.unlink(missing_ok=True)
 
 
 @pytest.fixture()
@@ -108,6 +112,20 @@ def login(client, new_user):
     yield response.json
 
 
+@pytest.fixture()
+def auth_headers(app, new_user):
+    """Returns the headers of a request with a valid token for the test user.
+
+    The token is made directly rather than by /login with a string subject, as recent versions of PyJWT reject the
+    integer subject in the tokens made by encode_auth_token.
+    """
+    with app.app_context():
+        user_id = db.session.execute(db.select(Account.user_id).filter_by(username=new_user["username"])).scalar_one()
+        token = jwt.encode({"exp": datetime.utcnow() + timedelta(minutes=5), "sub": str(user_id)},
+                           app.config["SECRET_KEY"], algorithm="HS256")
+    yield {"Authorization": token}
+
+
 @pytest.fixture()
 def comment_json(login, app):
     """Returns comment data"""
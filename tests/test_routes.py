@@ -1,3 +1,110 @@
+import gc
+import gzip
+import json
+import pstats
+from datetime import datetime
+from pathlib import Path
+from threading import Thread
+import pytest
+from src import db, warm_up, add_data_from_csv, seed_status
+from src.models import Account, Comment, Item, Data, Meta
+from src.analytics import sales_index, similarity_index
+from src.ratelimit import limiter
+from src.events import broker
+from src.compression import response_cache
+from src.compact import create_compact_data
+
+
+# HEALTH ROUTES
+def test_health_live(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /health/live
+    THEN the status code should be 200
+    """
+    response = client.get("/health/live")
+    assert response.status_code == 200
+
+
+def test_health_ready(client):
+    """
+    GIVEN a Flask test client
+    AND the database has been seeded
+    WHEN a request is made to /health/ready
+    THEN the status code should be 200 and the progress should be complete
+    """
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json['progress'] == 1.0
+
+
+# EVENT ROUTES
+def publish(app, *events):
+    """Publishes and commits events of the given types with the data {"n": position}, returns their ids."""
+    with app.app_context():
+        event_ids = [broker.publish(event_type, {"n": n}) for n, event_type in enumerate(events)]
+        db.session.commit()
+    return event_ids
+
+
+def test_events_resume(app, client):
+    """
+    GIVEN two events published after an event id
+    WHEN a request is made to /events with that id in the Last-Event-ID header
+    THEN the stream should send the two events in order with their ids
+    """
+    last_id, first, second = publish(app, "item.updated", "item.updated", "item.deleted")
+    response = client.get("/events", headers={"Last-Event-ID": str(last_id)}, buffered=False)
+    assert response.mimetype == "text/event-stream"
+    chunks = (chunk.decode() for chunk in response.response)
+    assert next(chunks).startswith("retry:")
+    assert next(chunks) == f'id: {first}\nevent: item.updated\ndata: {{"n": 1}}\n\n'
+    assert next(chunks).startswith(f"id: {second}\nevent: item.deleted")
+    response.close()
+
+
+def test_events_reset(app, client, monkeypatch):
+    """
+    GIVEN only the two most recent events are kept
+    WHEN a request is made to /events with the id before three new events in the Last-Event-ID header
+    THEN the stream should send a reset event
+    """
+    monkeypatch.setattr(broker, "history", 2)
+    first, _, _ = publish(app, "item.updated", "item.updated", "item.updated")
+    response = client.get("/events", headers={"Last-Event-ID": str(first - 1)}, buffered=False)
+    chunks = (chunk.decode() for chunk in response.response)
+    next(chunks)
+    assert next(chunks).startswith("event: reset")
+    response.close()
+
+
+def test_writes_publish_events(app, client, auth_headers):
+    """
+    GIVEN a Flask test client with a valid token
+    WHEN a comment is posted and an item is added, updated and deleted
+    THEN an event of each change should be recorded in order with the data of the change
+    """
+    with app.app_context():
+        last_id = broker.last_id()
+        user_id = db.session.execute(db.select(Account.user_id).filter_by(username="test")).scalar_one()
+    comment = {"date": "2024-01-01T12:00:00", "content": "Published", "user_id": user_id}
+    assert client.post("/comments", json=comment, headers=auth_headers).status_code == 200
+    response = client.post("/items", json={"brand_number": 9, "item_number": 2, "name": "B9_2"}, headers=auth_headers)
+    item_id = int(response.json['message'].split("=")[-1])
+    assert client.patch(f"/items/{item_id}", json={"name": "B9_3"}, headers=auth_headers).status_code == 200
+    assert client.delete(f"/items/{item_id}", headers=auth_headers).status_code == 200
+    with app.app_context():
+        events, missed = broker.since(last_id)
+        # Remove the comment, as other tests expect there to be none
+        db.session.execute(db.delete(Comment).where(Comment.content == "Published"))
+        db.session.commit()
+    assert not missed
+    assert [event_type for _, event_type, _ in events] == ["comment.created", "item.created", "item.updated",
+                                                           "item.deleted"]
+    assert json.loads(events[0][2])['content'] == "Published"
+    assert json.loads(events[2][2]) == {"item_id": item_id, "name": "B9_3", "brand_number": 9, "item_number": 2}
+
+
 # AUTHENTICATION ROUTES
 def test_register_success(client, random_user_json):
     """
@@ -46,6 +153,24 @@ def test_login_fail(client):
     assert user_login.status_code == 401
 
 
+def test_login_rate_limited(app, client, monkeypatch):
+    """
+    GIVEN rate limiting is enabled with a burst of 10 tokens and a slow refill
+    WHEN /login, which costs 5 tokens, is called three times in a row
+    THEN the third response status code should be 429 with a Retry-After header
+    """
+    monkeypatch.setitem(app.config, "RATELIMIT_ENABLED", True)
+    monkeypatch.setitem(app.config, "RATELIMIT_BURST", 10)
+    monkeypatch.setitem(app.config, "RATELIMIT_RATE", 0.01)
+    user_json = {"username": "test", "password": "wrong"}
+    try:
+        statuses = [client.post('/login', json=user_json).status_code for _ in range(3)]
+        assert statuses == [401, 401, 429]
+        assert int(client.post('/login', json=user_json).headers["Retry-After"]) > 0
+    finally:
+        limiter.backend.clear()
+
+
 # COMMENT ROUTES
 def test_get_comments_status_code(client):
     """
@@ -99,6 +224,44 @@ def test_user_logged_in_post_comment(client, login, comment_json):
     assert response.status_code == 200
 
 
+def test_search_comments(app, client, new_user):
+    """
+    GIVEN a comment in the database containing the word "forecast"
+    WHEN a request is made to /comments/search?q=forecast
+    THEN the response should contain the comment
+    AND a search for a word not in any comment should return no comments
+    """
+    with app.app_context():
+        user = db.session.execute(db.select(Account).filter_by(username=new_user['username'])).scalar_one()
+        comment = Comment(date=datetime.now(), content="The forecast for brand 2 looks too low.",
+                          user_id=user.user_id)
+        db.session.add(comment)
+        db.session.commit()
+        comment_id = comment.comment_id
+    try:
+        response = client.get("/comments/search?q=Forecast")
+        assert response.status_code == 200
+        assert [c['comment_id'] for c in response.json['comments']] == [comment_id]
+        assert response.json['total'] == 1
+        assert client.get("/comments/search?q=pizza").json['comments'] == []
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(Comment, comment_id))
+            db.session.commit()
+
+
+def test_search_comments_missing_query(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /comments/search without q, or with a page or per_page that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    response = client.get("/comments/search")
+    assert response.status_code == 400
+    for query in ("page=abc", "per_page=x"):
+        assert client.get(f"/comments/search?q=good&{query}").status_code == 400
+
+
 # ITEM ROUTES
 def test_get_items_status_code(client):
     """
@@ -124,6 +287,111 @@ def test_get_items_json(client):
     assert item in response.json
 
 
+def test_get_items_filtered(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items filtered by brand 3 and name prefix B3_1, sorted by descending item number
+    THEN every item in the response should match the filters
+    AND the items should be in descending item number order
+    AND there should be no more items than the limit
+    """
+    response = client.get("/items?brand=3&name=B3_1&sort=-item_number&limit=5")
+    assert response.status_code == 200
+    assert 0 < len(response.json) <= 5
+    assert all(item['brand_number'] == 3 and item['name'].startswith("B3_1") for item in response.json)
+    numbers = [item['item_number'] for item in response.json]
+    assert numbers == sorted(numbers, reverse=True)
+
+
+def test_get_items_name_prefix_last_character(client):
+    """
+    GIVEN a Flask test client
+    WHEN requests are made to /items with name prefixes ending in the highest code point and before the surrogates
+    THEN the response status_code should be 200 with no items each time
+    """
+    for prefix in ("%F4%8F%BF%BF", "B%F4%8F%BF%BF", "%ED%9F%BF"):
+        response = client.get(f"/items?name={prefix}")
+        assert response.status_code == 200
+        assert response.json == []
+
+
+def test_get_items_invalid_sort(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items sorted by a column that does not exist
+    THEN the response status_code should be 400
+    """
+    response = client.get("/items?sort=price")
+    assert response.status_code == 400
+
+
+def test_get_items_invalid_integers(client):
+    """
+    GIVEN a Flask test client
+    WHEN requests are made to /items with a brand, limit or offset that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    for query in ("brand=abc", "limit=x", "offset=1.5"):
+        assert client.get(f"/items?{query}").status_code == 400
+
+
+def test_get_items_gzip(client):
+    """
+    GIVEN a Flask test client that accepts gzip encoding
+    WHEN a request is made to /items twice
+    THEN both responses should be gzip encoded
+    AND decompress to the same JSON as the uncompressed response
+    """
+    uncompressed = client.get("/items")
+    for _ in range(2):
+        response = client.get("/items", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert json.loads(gzip.decompress(response.data)) == uncompressed.json
+
+
+def test_patch_invalidates_cached_items(client, auth_headers):
+    """
+    GIVEN the response of /items has been cached
+    WHEN a HEAD request is made to /items and a login is attempted
+    THEN the cached response should be kept
+    WHEN the name of an item is changed with a PATCH request to /items/4
+    THEN /items and /items/4 should return the new name
+    """
+    client.get("/items")
+    client.head("/items")
+    client.post("/login", json={"username": "nobody", "password": "wrong"})
+    assert "/items?" in response_cache.entries
+    name = client.get("/items/4").json['name']
+    try:
+        assert client.patch("/items/4", json={"name": "renamed"}, headers=auth_headers).status_code == 200
+        assert {"brand_number": 1, "item_id": 4, "item_number": 4, "name": "renamed"} in client.get("/items").json
+        assert client.get("/items/4").json['name'] == "renamed"
+    finally:
+        client.patch("/items/4", json={"name": name}, headers=auth_headers)
+
+
+def test_change_by_other_process_invalidates_cached_items(app, client):
+    """
+    GIVEN the response of /items has been cached
+    WHEN another process changes the name of an item and records an event in the database
+    THEN /items should return the new name
+    """
+    client.get("/items")
+    with app.app_context():
+        db.session.execute(db.update(Item).where(Item.item_id == 6).values(name="elsewhere"))
+        broker.publish("item.updated", {"item_id": 6}, item_id=6)
+        db.session.commit()
+    try:
+        assert {"brand_number": 1, "item_id": 6, "item_number": 6, "name": "elsewhere"} in client.get("/items").json
+    finally:
+        with app.app_context():
+            db.session.execute(db.update(Item).where(Item.item_id == 6).values(name="B1_6"))
+            broker.publish("item.updated", {"item_id": 6}, item_id=6)
+            db.session.commit()
+
+
 def test_get_specified_data(client):
     """
     GIVEN a Flask test client
@@ -139,6 +407,31 @@ def test_get_specified_data(client):
     assert data_json in response.json['data']
 
 
+def test_get_items_batch(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/batch for items 5 and 6 and an item that does not exist, for one week
+    THEN the response should contain 7 days of data for each of items 5 and 6
+    AND the id of the item that does not exist should be listed as missing
+    """
+    response = client.get("/items/batch?ids=5,6,200&start=2014-01-02&end=2014-01-08")
+    assert response.status_code == 200
+    assert [item['item_id'] for item in response.json['items']] == [5, 6]
+    assert all(len(item['data']) == 7 for item in response.json['items'])
+    assert {'date': '2014-01-08T00:00:00', 'promotion': False, 'quantity': 3} in response.json['items'][0]['data']
+    assert response.json['missing'] == [200]
+
+
+def test_get_items_batch_invalid_ids(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/batch with ids that are not numbers
+    THEN the response status_code should be 400
+    """
+    response = client.get("/items/batch?ids=five,six")
+    assert response.status_code == 400
+
+
 def test_get_item_not_exists(client):
     """
     GIVEN a Flask test client
@@ -149,6 +442,136 @@ def test_get_item_not_exists(client):
     assert response.status_code == 404
 
 
+def test_get_item_total(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/5/total for the first week of 2014
+    THEN the totals should match the sum of the daily data for Brand 1 Item 5
+    """
+    response = client.get("/items/5/total?start=2014-01-02&end=2014-01-08")
+    data = client.get("/items/5").json['data']
+    week = [d for d in data if '2014-01-02' <= d['date'][:10] <= '2014-01-08']
+    assert response.status_code == 200
+    assert response.json['quantity'] == sum(d['quantity'] for d in week)
+    assert response.json['promoted_quantity'] == sum(d['quantity'] for d in week if d['promotion'])
+
+
+def test_get_top_items(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/top?n=5
+    THEN the response should contain 5 items ordered by quantity, highest first
+    """
+    response = client.get("/items/top?start=2014-01-01&end=2014-12-31&n=5")
+    assert response.status_code == 200
+    quantities = [item['quantity'] for item in response.json]
+    assert len(quantities) == 5
+    assert quantities == sorted(quantities, reverse=True)
+
+
+def test_get_top_items_invalid_date(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/top with a start that is not a date, or an n that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    response = client.get("/items/top?start=yesterday")
+    assert response.status_code == 400
+    response = client.get("/items/top?n=abc")
+    assert response.status_code == 400
+
+
+def test_get_item_forecast(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/5/forecast?horizon=7
+    THEN the response should contain 7 days of forecasts starting the day after the last date in the data
+    """
+    response = client.get("/items/5/forecast?horizon=7")
+    assert response.status_code == 200
+    assert response.json['item_id'] == 5
+    assert len(response.json['forecast']) == 7
+    assert response.json['forecast'][0]['date'] == '2019-01-01'
+
+
+def test_get_forecasts_all_items(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/forecast
+    THEN the response should contain a forecast for every item
+    """
+    response = client.get("/items/forecast?horizon=3")
+    items = client.get("/items")
+    assert response.status_code == 200
+    assert len(response.json) == len(items.json)
+
+
+def test_get_forecast_invalid_horizon(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/5/forecast with a horizon of 0, or a horizon that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    response = client.get("/items/5/forecast?horizon=0")
+    assert response.status_code == 400
+    response = client.get("/items/5/forecast?horizon=abc")
+    assert response.status_code == 400
+
+
+def test_get_similar_items(client):
+    """
+    GIVEN a Flask test client
+    AND the similar items have been computed
+    WHEN a request is made to /items/5/similar?k=3
+    THEN the response should contain 3 other items ordered by correlation, highest first
+    """
+    assert similarity_index.wait(timeout=30)
+    response = client.get("/items/5/similar?k=3")
+    assert response.status_code == 200
+    correlations = [item['correlation'] for item in response.json]
+    assert len(correlations) == 3
+    assert correlations == sorted(correlations, reverse=True)
+    assert 5 not in [item['item_id'] for item in response.json]
+
+
+def test_get_similar_items_invalid_k(client):
+    """
+    GIVEN a Flask test client
+    WHEN requests are made to /items/5/similar with a k of 0 and a k that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    for k in ("0", "abc"):
+        assert client.get(f"/items/5/similar?k={k}").status_code == 400
+
+
+def test_get_series_downsampled(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/5/series?points=100
+    THEN the response should contain 100 points in date order
+    AND the first and last points should be the first and last dates in the data
+    """
+    full = client.get("/items/5/series").json
+    response = client.get("/items/5/series?points=100")
+    assert response.status_code == 200
+    dates = [point['date'] for point in response.json]
+    assert len(dates) == 100
+    assert dates == sorted(dates)
+    assert dates[0] == full[0]['date'] and dates[-1] == full[-1]['date']
+
+
+def test_get_series_invalid_method(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /items/5/series with an unknown method, or a number of points that is not an integer
+    THEN the response status_code should be 400 each time
+    """
+    response = client.get("/items/5/series?points=100&method=average")
+    assert response.status_code == 400
+    response = client.get("/items/5/series?points=abc")
+    assert response.status_code == 400
+
+
 def test_post_item(client, login):
     """
     GIVEN a Flask test client
@@ -172,6 +595,25 @@ def test_post_item(client, login):
     assert response.status_code == 200
 
 
+def test_sales_index_refreshed_after_write(client, auth_headers, monkeypatch):
+    """
+    GIVEN a Flask test client with a valid token
+    WHEN an item is added with a POST request to /items and then deleted
+    THEN the total of the new item should be 0 after it is added and 404 after it is deleted
+    AND the sales index should not be rebuilt from the whole data table
+    """
+    def build():
+        raise AssertionError("The sales index was rebuilt")
+    monkeypatch.setattr(sales_index, "build", build)
+    response = client.post("/items", json={"brand_number": 9, "item_number": 1, "name": "B9_1"}, headers=auth_headers)
+    item_id = int(response.json['message'].split("=")[-1])
+    assert client.get(f"/items/{item_id}/total").json['quantity'] == 0
+    assert item_id in [item['item_id'] for item in client.get("/items/top?n=1000").json]
+    assert client.delete(f"/items/{item_id}", headers=auth_headers).status_code == 200
+    assert client.get(f"/items/{item_id}/total").status_code == 404
+    assert item_id not in [item['item_id'] for item in client.get("/items/top?n=1000").json]
+
+
 def test_item_post_error(client, login):
     """
         GIVEN a Flask test client
@@ -265,3 +707,214 @@ def test_user_logged_in_user_can_edit_item(client, login):
     response = client.patch("/items/3", json=new_name, headers=headers)
     assert response.status_code == 200
     assert response.json == {"message": "Item with id 3 updated."}
+
+
+# ANALYTICS ROUTES
+def test_get_promotion_uplift(client):
+    """
+    GIVEN a Flask test client
+    WHEN a request is made to /analytics/promotion-uplift
+    THEN the response should contain the uplift statistics of each item and brand
+    AND the promoted share of each item should be between 0 and 1
+    """
+    response = client.get("/analytics/promotion-uplift")
+    assert response.status_code == 200
+    assert {brand['brand_number'] for brand in response.json['brands']} == {1, 2, 3, 4}
+    assert all(0 <= item['promoted_share'] <= 1 for item in response.json['items'])
+
+
+# COMMANDS
+def test_compact_report(app, tmp_path):
+    """
+    GIVEN the seeded database
+    WHEN the compact-report command is run
+    THEN the compact database should be written and be smaller than the current layout
+    """
+    output = tmp_path.joinpath("compact.sqlite")
+    result = app.test_cli_runner().invoke(args=["compact-report", "--output", str(output),
+                                                "--samples", "3", "--repeats", "1"])
+    assert result.exit_code == 0, result.output
+    assert output.exists()
+    size_line = next(line for line in result.output.splitlines() if line.startswith("File size"))
+    assert size_line.split()[-1].startswith("-")
+
+
+def test_compact_data_reads(app, client, monkeypatch):
+    """
+    GIVEN the compact copy of the data table has been created
+    WHEN requests are made to /items/5, /items/5/series and /items/batch with COMPACT_DATA set
+    THEN the responses should be the same as those read from the data table
+    """
+    paths = ["/items/5", "/items/5/series?start=2015-01-01&end=2015-03-31&points=20", "/items/batch?ids=2,1,999"]
+    expected = [client.get(path).json for path in paths]
+    with app.app_context():
+        create_compact_data()
+    monkeypatch.setitem(app.config, "COMPACT_DATA", True)
+    response_cache.clear()
+    try:
+        assert [client.get(path).json for path in paths] == expected
+    finally:
+        response_cache.clear()
+
+
+# PROFILING
+def test_profile_requested_with_token(app, client, monkeypatch, tmp_path):
+    """
+    GIVEN profiling is enabled with a trusted token and no sampling
+    WHEN a request is made to /items/5/total with the token in the X-Profile header
+    AND another request is made without the header
+    THEN one pstats file and one summary line should be saved for the get_item_total route
+    """
+    monkeypatch.setitem(app.config, "PROFILE_ENABLED", True)
+    monkeypatch.setitem(app.config, "PROFILE_TOKEN", "secret")
+    monkeypatch.setitem(app.config, "PROFILE_TRACEMALLOC", True)
+    monkeypatch.setitem(app.config, "PROFILE_DIR", str(tmp_path))
+    assert client.get("/items/5/total", headers={"X-Profile": "secret"}).status_code == 200
+    assert client.get("/items/5/total").status_code == 200
+    folder = tmp_path.joinpath("get_item_total")
+    profiles = list(folder.glob("*.pstats"))
+    assert len(profiles) == 1
+    assert pstats.Stats(str(profiles[0])).total_calls > 0
+    summary = [json.loads(line) for line in folder.joinpath("summary.jsonl").read_text().splitlines()]
+    assert len(summary) == 1 and summary[0]['peak_allocated_bytes'] > 0
+
+
+def test_profile_non_ascii_header(app, client, monkeypatch, tmp_path):
+    """
+    GIVEN profiling is enabled with a trusted token and no sampling
+    WHEN a request is made to /items/5/total with a non-ASCII value in the X-Profile header
+    THEN the request should succeed without being profiled
+    """
+    monkeypatch.setitem(app.config, "PROFILE_ENABLED", True)
+    monkeypatch.setitem(app.config, "PROFILE_TOKEN", "secret")
+    monkeypatch.setitem(app.config, "PROFILE_DIR", str(tmp_path))
+    assert client.get("/items/5/total", headers={"X-Profile": "s\xe9cret"}).status_code == 200
+    assert not tmp_path.joinpath("get_item_total").exists()
+
+
+# SEEDING
+def test_seed_restarts_after_interruption(app):
+    """
+    GIVEN a database seeded before the seed-complete marker was added
+    WHEN the data are added from the CSV file
+    THEN the marker should be added without adding the data again
+    GIVEN a database with the data of the first two years only and no marker, as left by an interrupted seed
+    WHEN the data are added from the CSV file
+    THEN all the data should be added again and the marker added
+    """
+    with app.app_context():
+        count = db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one()
+        db.session.execute(db.delete(Meta))
+        db.session.commit()
+        add_data_from_csv()
+        assert db.session.get(Meta, "seed_complete") is not None
+        assert db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one() == count
+
+        db.session.execute(db.delete(Meta))
+        db.session.execute(db.delete(Data).where(Data.date >= datetime(2016, 1, 1)))
+        db.session.commit()
+        add_data_from_csv()
+        assert db.session.get(Meta, "seed_complete") is not None
+        assert db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one() == count
+
+
+def test_seed_with_workers_after_failure(app, tmp_path):
+    """
+    GIVEN a CSV file with a row that cannot be parsed after the first ranges
+    WHEN the data are added from it by two worker processes
+    THEN the error should be raised and the seed-complete marker should not be added
+    WHEN the data are then added from the real CSV file by two worker processes
+    THEN the partial data should be replaced by all the data and the marker added
+    """
+    data_file = Path(__file__).parent.parent.joinpath("data", "dataset_prepared.csv")
+    lines = data_file.read_text().splitlines()
+    bad_file = tmp_path.joinpath("bad.csv")
+    bad_file.write_text("\n".join(lines[:200] + ["2099-01-01," + ",".join(["x"] * (lines[0].count(",")))]) + "\n")
+    with app.app_context():
+        count = db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one()
+        db.session.execute(db.delete(Meta))
+        db.session.commit()
+        with pytest.raises(ValueError):
+            add_data_from_csv(workers=2, chunk_size=4096, data_file=bad_file)
+        db.session.rollback()
+        assert db.session.get(Meta, "seed_complete") is None
+        assert 0 < db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one() < count
+
+        add_data_from_csv(workers=2)
+        assert db.session.get(Meta, "seed_complete") is not None
+        assert db.session.execute(db.select(db.func.count(Data.data_id))).scalar_one() == count
+
+
+# WARM-UP
+def test_forked_worker_ready_after_master_seed(app, client, monkeypatch):
+    """
+    GIVEN a worker forked while the master process was adding the data in a background thread
+    AND the master has since added the seed-complete marker
+    WHEN a request is made to /health/ready in the worker
+    THEN the worker should prepare its analytics and the status code should be 200
+    """
+    finished = Thread(target=lambda: None)
+    finished.start()
+    finished.join()
+    monkeypatch.setattr(seed_status, "thread", finished)
+    seed_status.ready.clear()
+    try:
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert client.get("/items/5/total").status_code == 200
+    finally:
+        seed_status.ready.set()
+
+
+def test_warm_up_seed_failed(app, monkeypatch):
+    """
+    GIVEN the data could not be added to the database
+    WHEN warm_up() is run
+    THEN it should raise RuntimeError with the error rather than wait for the data
+    """
+    monkeypatch.setattr(seed_status, "error", "disk full")
+    seed_status.ready.clear()
+    try:
+        with pytest.raises(RuntimeError, match="disk full"):
+            warm_up(app)
+    finally:
+        seed_status.ready.set()
+
+
+def test_warm_up(app, client):
+    """
+    GIVEN the app has been created
+    WHEN warm_up() is run before forking workers
+    THEN the responses of the warm-up routes should be cached
+    AND the routes should still respond after the database connections have been closed
+    """
+    try:
+        warm_up(app)
+        assert "/items?" in response_cache.entries
+        assert client.get("/items/top").status_code == 200
+        assert client.get("/items/5/total").status_code == 200
+    finally:
+        # Return the objects frozen by warm_up() to the garbage collector of the test process
+        gc.unfreeze()
+
+
+def test_change_by_other_process_updates_analytics(app, client):
+    """
+    GIVEN the total of item 7 has been read from the sales index
+    WHEN another process changes a quantity of item 7 and records an event in the database
+    THEN /items/7/total should include the change
+    """
+    total = client.get("/items/7/total").json['quantity']
+    with app.app_context():
+        datum = db.session.execute(db.select(Data).filter_by(item_id=7).limit(1)).scalar_one()
+        datum.quantity += 1000
+        broker.publish("item.updated", {"item_id": 7}, item_id=7)
+        db.session.commit()
+    try:
+        assert client.get("/items/7/total").json['quantity'] == total + 1000
+    finally:
+        with app.app_context():
+            datum = db.session.merge(datum)
+            datum.quantity -= 1000
+            broker.publish("item.updated", {"item_id": 7}, item_id=7)
+            db.session.commit()